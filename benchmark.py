@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+from synthetic_data import generate_patient, generate_patients
+from main import iter_measurements, process_csv_files
+from glucose_analyzer import analyze_high_glucose_batch
+from glucose_store import GlucoseStore
+from report_generator import GLUCOSE_THRESHOLD, generate_html_report
+
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Data sets: (patients, days per patient); 0 patients means a single patient directory
+SIZES = {
+    'day': (0, 1),
+    'month': (0, 30),
+    'year': (0, 365),
+    '5years': (0, 1825),
+    'patients': (20, 30),
+}
+DEFAULT_SIZES = ['day', 'month', 'year', 'patients']
+START = datetime(2021, 1, 1)
+MIN_RUN_SECONDS = 0.2
+MIN_REGRESSION_SECONDS = 0.005
+
+def prepare_workspaces(workdir: str, size: str) -> List[str]:
+    """Generate (or reuse) synthetic exports for a data set; return one workspace per patient.
+
+    Each workspace is laid out like the project directory: data/source holds the CSVs.
+    """
+    patients, days = SIZES[size]
+    size_dir = os.path.join(workdir, size)
+    marker = os.path.join(size_dir, '.generated')
+    if not os.path.exists(marker):
+        shutil.rmtree(size_dir, ignore_errors=True)
+        if patients:
+            generate_patients(os.path.join(size_dir, 'patients'), patients, START, days)
+        else:
+            generate_patient(os.path.join(size_dir, 'patients', 'patient_001'), START, days)
+        open(marker, 'w').close()
+    workspaces = []
+    for patient in sorted(os.listdir(os.path.join(size_dir, 'patients'))):
+        workspace = os.path.join(size_dir, 'workspaces', patient)
+        source_dir = os.path.join(workspace, 'data', 'source')
+        if not os.path.isdir(source_dir):
+            os.makedirs(os.path.dirname(source_dir), exist_ok=True)
+            shutil.copytree(os.path.join(size_dir, 'patients', patient), source_dir)
+        workspaces.append(os.path.abspath(workspace))
+    return workspaces
+
+def reset_outputs(workspace: str):
+    """Remove everything main.py produced in a workspace"""
+    for path in ('data/processed', 'data/cache', 'data/user'):
+        shutil.rmtree(os.path.join(workspace, path), ignore_errors=True)
+    for path in ('data/manifest.json', 'glucose_report.html'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(workspace, path))
+
+@contextlib.contextmanager
+def in_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def run_in_workspaces(workspaces: List[str], func: Callable[[], int]) -> int:
+    """Run func in every workspace with its output silenced; return the summed units"""
+    units = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for workspace in workspaces:
+            with in_directory(workspace):
+                units += func()
+    return units
+
+def stage_parse() -> int:
+    source_dir = 'data/source'
+    return sum(sum(1 for _ in iter_measurements(os.path.join(source_dir, filename)))
+               for filename in sorted(os.listdir(source_dir)))
+
+def stage_ingest() -> int:
+    process_csv_files(full=True, report=False)
+    return sum(len(record) for record in GlucoseStore('data/processed').read_range())
+
+def stage_reingest() -> int:
+    process_csv_files(report=False)
+    return len(os.listdir('data/source'))
+
+def stage_analyze() -> int:
+    records = list(GlucoseStore('data/processed').read_range())
+    analyze_high_glucose_batch(records, GLUCOSE_THRESHOLD)
+    return len(records)
+
+def stage_report() -> int:
+    generate_html_report('data/processed', 'glucose_report.html', use_cache=False)
+    return len(GlucoseStore('data/processed').dates())
+
+def stage_report_fast() -> int:
+    generate_html_report('data/processed', 'glucose_report.html', use_cache=False, fast_render=True)
+    return len(GlucoseStore('data/processed').dates())
+
+# Stage name: (function, unit, whether the store must be rebuilt before each run)
+STAGES = {
+    'parse': (stage_parse, 'readings', False),
+    'ingest': (stage_ingest, 'readings', True),
+    'reingest': (stage_reingest, 'files', False),
+    'analyze': (stage_analyze, 'days', False),
+    'report': (stage_report, 'days', False),
+    'report_fast': (stage_report_fast, 'days', False),
+}
+
+def measure(workspaces: List[str], stage: str, repeat: int) -> dict:
+    """Best-of-repeat time per run and, from a separate traced run, the peak of Python allocations"""
+    func, unit, fresh = STAGES[stage]
+
+    def prepare():
+        if fresh:
+            for workspace in workspaces:
+                reset_outputs(workspace)
+
+    timings = []
+    units = 0
+    for _ in range(repeat):
+        # Short stages run several times, so timer noise does not dominate small data sets
+        elapsed = 0.0
+        runs = 0
+        while runs == 0 or elapsed < MIN_RUN_SECONDS:
+            prepare()
+            started = time.perf_counter()
+            units = run_in_workspaces(workspaces, func)
+            elapsed += time.perf_counter() - started
+            runs += 1
+        timings.append(elapsed / runs)
+    best = min(timings)
+
+    # Tracing slows the code down, so memory is measured in a separate, untimed run
+    prepare()
+    tracemalloc.start()
+    try:
+        run_in_workspaces(workspaces, func)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'seconds': round(best, 4),
+        'units': units,
+        'unit': unit,
+        'throughput': round(units / best, 1) if best else 0.0,
+        'peak_mb': round(peak / 1024 / 1024, 2)
+    }
+
+def run_benchmarks(workdir: str, sizes: List[str], stages: List[str], repeat: int) -> Dict[str, dict]:
+    results = {}
+    for size in sizes:
+        workspaces = prepare_workspaces(workdir, size)
+        for workspace in workspaces:
+            reset_outputs(workspace)
+        # Stages run in order, so later stages find the store written by ingest
+        run_in_workspaces(workspaces, lambda: process_csv_files(full=True, report=False) or 0)
+        results[size] = {}
+        for stage in stages:
+            result = measure(workspaces, stage, repeat)
+            results[size][stage] = result
+            print(f"{size:>9} {stage:<12} {result['seconds']:>9.4f}s {result['throughput']:>12.1f} "
+                  f"{result['unit']}/s {result['peak_mb']:>9.2f} MB peak")
+    return results
+
+def compare_with_baseline(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Return regressions: throughput or peak memory worse than the baseline by more than tolerance"""
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is None:
+                continue
+            # A few milliseconds more per run are timer and file system noise on tiny data sets
+            slower = result['seconds'] - reference['seconds'] > MIN_REGRESSION_SECONDS
+            if slower and result['throughput'] < reference['throughput'] * (1 - tolerance):
+                regressions.append(f"{size}/{stage}: throughput {result['throughput']} {result['unit']}/s "
+                                   f"< baseline {reference['throughput']}")
+            # Ignore growth below 1 MB, which is mostly noise on small data sets
+            if result['peak_mb'] > reference['peak_mb'] * (1 + tolerance) + 1:
+                regressions.append(f"{size}/{stage}: peak memory {result['peak_mb']} MB "
+                                   f"> baseline {reference['peak_mb']} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingest, analysis and report generation on synthetic data')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help=f"comma-separated data sets out of {', '.join(SIZES)} (default: %(default)s)")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma-separated stages to run (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best counts (default: 3)')
+    parser.add_argument('--workdir', help='keep generated data in DIR between runs (default: a temporary directory)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown or memory growth as a fraction (default: 0.25)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    stages = args.stages.split(',')
+    unknown = [name for name in sizes if name not in SIZES] + [name for name in stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown size or stage: {', '.join(unknown)}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='glucose-benchmark-')
+    try:
+        results = run_benchmarks(workdir, sizes, stages, max(1, args.repeat))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        for size, size_results in results.items():
+            baseline.setdefault(size, {}).update(size_results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline in {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from day_record import DayRecord, HighGlucosePeriod
+from glucose_analyzer import IncrementalAnalyzer
+from glucose_store import GlucoseStore
+from notes_manager import NotesManager
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 512
+
+class DayPayload:
+    """Serialized JSON of one processed day with its ETag and gzip variant"""
+
+    __slots__ = ('body', 'etag', 'source', '_gzipped')
+
+    def __init__(self, body: bytes, source: str):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        # Block id of the day the body was built from; a different one means the day changed
+        self.source = source
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+class DayDataService:
+    """Indexed in-memory cache of processed days (notes overrides applied) for the HTTP API.
+
+    Days are serialized once and kept until the store index or the day's note
+    overrides change. The store index is checked for changes at most once per
+    check_interval seconds.
+    """
+
+    def __init__(self, store: GlucoseStore, notes_manager: NotesManager, check_interval: float = 1.0):
+        self.store = store
+        self.notes_manager = notes_manager
+        self.check_interval = check_interval
+        self._payloads: Dict[str, DayPayload] = {}
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+        self._index = store.days
+
+    def refresh(self):
+        """Pick up a store index replaced by main.py and drop days that were rewritten"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            self.store.reload_if_changed()
+            # The index may also have been reloaded by another user of the store
+            if self.store.days is not self._index:
+                self._index = self.store.days
+                self._payloads = {date: payload for date, payload in self._payloads.items()
+                                  if payload.source == self._source(date)}
+
+    def warm(self) -> int:
+        """Serialize all stored days up front; return their number"""
+        with self._lock:
+            self.store.reload_if_changed()
+            for date in self.store.dates():
+                self.day(date)
+            return len(self._payloads)
+
+    def invalidate(self, date: str):
+        """Forget the cached day (e.g. after its note was edited)"""
+        with self._lock:
+            self._payloads.pop(date, None)
+
+    def _source(self, date: str) -> Optional[str]:
+        return self.store.block_id(date)
+
+    def dates(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        return self.store.dates_in_range(start, end)
+
+    def day(self, date: str) -> Optional[DayPayload]:
+        """Return the cached payload of a day, or None if the store has no such day"""
+        with self._lock:
+            payload = self._payloads.get(date)
+            if payload is not None:
+                return payload
+            source = self._source(date)
+            if source is None:
+                return None
+            record = self.notes_manager.apply_overrides(self.store.read_day(date))
+            body = json.dumps(record.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            payload = self._payloads[date] = DayPayload(body, source)
+            return payload
+
+    def day_range(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[bytes, str]:
+        """Return a JSON array of days in [start, end] and its ETag"""
+        with self._lock:
+            payloads = [self.day(date) for date in self.dates(start, end)]
+        body = b'[' + b','.join(payload.body for payload in payloads) + b']'
+        etag = hashlib.sha1(' '.join(payload.etag for payload in payloads).encode('ascii')).hexdigest()
+        return body, etag
+
+class LiveFeed:
+    """Turns readings appended to the newest stored day into server-sent events.
+
+    The newest day is tracked with an IncrementalAnalyzer, so a poll only handles
+    rows added since the previous one. Events are kept in a short numbered log that
+    every connected client reads from with events_since().
+    """
+
+    def __init__(self, store: GlucoseStore, glucose_threshold: float, history: int = 1000):
+        self.store = store
+        self.glucose_threshold = glucose_threshold
+        self._events: Deque[Tuple[int, str, dict]] = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._source: Optional[str] = None
+        self._analyzer: Optional[IncrementalAnalyzer] = None
+        self._rows: List[tuple] = []
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def _emit(self, name: str, data: dict):
+        self._seq += 1
+        self._events.append((self._seq, name, data))
+
+    def _period_event(self, record: DayRecord, period: HighGlucosePeriod, index: int, closed: bool):
+        self._emit('period', {
+            'date': record.date,
+            'index': index,
+            'start_time': record.timestamp(period.first_row),
+            'end_time': record.minute_timestamp(period.end_minute),
+            'points': period.points,
+            'closed': closed
+        })
+
+    def _feed(self, record: DayRecord, first_row: int, announce: bool):
+        rows = _day_rows(record)
+        for row in range(first_row, len(record)):
+            minute, value = rows[row]
+            period = self._analyzer.add(minute, value)
+            if not announce:
+                continue
+            self._emit('reading', {'date': record.date, 'timestamp': record.timestamp(row),
+                                   'glucose_value': value, 'note': record.notes.get(row)})
+            if period is not None:
+                closed = self._analyzer.open_period() is None
+                index = len(self._analyzer.closed) - 1 if closed else len(self._analyzer.closed)
+                self._period_event(record, period, index, closed)
+        self._rows = rows
+
+    def poll(self):
+        """Check the newest stored day for new rows and log events for them"""
+        with self._lock:
+            dates = self.store.dates()
+            if not dates:
+                return
+            if self._analyzer is not None and self._analyzer.date != dates[-1] \
+                    and self._analyzer.date in self.store.days:
+                # Readings up to midnight can arrive together with the first ones of the next day
+                self._follow(self._analyzer.date)
+            self._follow(dates[-1])
+
+    def _follow(self, date: str):
+        source = self.store.block_id(date)
+        if source == self._source:
+            return
+        first_poll = self._source is None
+        self._source = source
+        record = self.store.read_day(date)
+
+        analyzer = self._analyzer
+        if analyzer is not None and analyzer.date == date and _day_rows(record)[:analyzer.rows] == self._rows:
+            # Rows were appended to the day we follow
+            self._feed(record, analyzer.rows, announce=True)
+            return
+
+        is_new_day = analyzer is None or analyzer.date != date
+        self._analyzer = IncrementalAnalyzer(date, self.glucose_threshold)
+        if first_poll or not is_new_day:
+            # Start following, or the day was rebuilt from other data: clients reload it whole
+            self._feed(record, 0, announce=False)
+            if not first_poll:
+                self._emit('day', {'date': date, 'reload': True})
+        else:
+            self._emit('day', {'date': date, 'reload': False})
+            self._feed(record, 0, announce=True)
+
+    def events_since(self, seq: int) -> List[Tuple[int, str, dict]]:
+        """Return logged events numbered above seq"""
+        with self._lock:
+            return [event for event in self._events if event[0] > seq]
+
+def _day_rows(record: DayRecord) -> List[Tuple[int, Optional[float]]]:
+    """(minute, glucose value or None) of every row of a day"""
+    return [(minute, None if value != value else value)
+            for minute, value in zip(record.minutes.tolist(), record.glucose_values().tolist())]
@@ -0,0 +1,139 @@
+import bisect
+from typing import Dict, List, Optional
+import numpy as np
+
+# 'HH:MM' for every minute of the day, to build timestamps without strftime
+MINUTE_LABELS = [f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(24 * 60)]
+
+def minute_of_day(timestamp: str) -> int:
+    """Return minutes since midnight of a 'YYYY-MM-DDTHH:MM:00' timestamp"""
+    return int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+
+class HighGlucosePeriod:
+    """High glucose period stored as row references into its DayRecord"""
+    __slots__ = ('first_row', 'count', 'end_minute', 'end_value', 'points')
+
+    def __init__(self, first_row: int, count: int, end_minute: int, end_value: Optional[float], points: float):
+        self.first_row = first_row    # row of the first reading above the threshold
+        self.count = count            # number of readings with a glucose value in the period
+        self.end_minute = end_minute
+        self.end_value = end_value
+        self.points = points
+
+    def to_list(self) -> list:
+        return [self.first_row, self.count, self.end_minute, self.end_value, self.points]
+
+class DayRecord:
+    """One day of readings held in typed arrays, sorted by time.
+
+    minutes are int32 offsets from midnight, values are float32 glucose readings
+    (NaN for rows that only carry a note) and notes map row -> text. Timestamps are
+    parsed once at ingest; consumers work on the arrays instead of re-parsing strings.
+    """
+    __slots__ = ('date', 'minutes', 'values', 'notes', 'periods')
+
+    def __init__(self, date: str, minutes: np.ndarray, values: np.ndarray,
+                 notes: Optional[Dict[int, str]] = None, periods: Optional[List[HighGlucosePeriod]] = None):
+        self.date = date
+        self.minutes = minutes
+        self.values = values
+        self.notes = notes if notes is not None else {}
+        self.periods = periods if periods is not None else []
+
+    def __len__(self) -> int:
+        return len(self.minutes)
+
+    @classmethod
+    def from_measurements(cls, date: str, measurements: List[dict]) -> 'DayRecord':
+        """Build a record from measurement dicts of one day (stable-sorted by time)"""
+        if any(m['timestamp'][:10] != date for m in measurements):
+            raise ValueError(f"Measurements do not all belong to {date}")
+        minutes = np.array([minute_of_day(m['timestamp']) for m in measurements], dtype=np.int32)
+        values = np.array([np.nan if m['glucose_value'] is None else m['glucose_value'] for m in measurements],
+                          dtype=np.float32)
+
+        order = np.argsort(minutes, kind='stable')
+        if np.any(order[1:] < order[:-1]):
+            minutes, values = minutes[order], values[order]
+            measurements = [measurements[i] for i in order]
+        notes = {row: m['note'] for row, m in enumerate(measurements) if m['note']}
+        return cls(date, minutes, values, notes)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DayRecord':
+        """Build a record from the processed JSON form, including its periods"""
+        record = cls.from_measurements(data['date'], data['measurements'])
+        for period in data['high_glucose_periods']:
+            start_minute = minute_of_day(period['start_time'])
+            start_value = np.float32(period['start_value'])
+            first_row = int(np.searchsorted(record.minutes, start_minute))
+            while (first_row + 1 < len(record) and record.minutes[first_row] == start_minute
+                   and record.values[first_row] != start_value):
+                first_row += 1
+            record.periods.append(HighGlucosePeriod(first_row, len(period['measurements']),
+                                                    minute_of_day(period['end_time']),
+                                                    period['end_value'], period['points']))
+        return record
+
+    def timestamp(self, row: int) -> str:
+        """Return the 'YYYY-MM-DDTHH:MM:00' timestamp of a row"""
+        return f"{self.date}T{MINUTE_LABELS[self.minutes[row]]}:00"
+
+    def minute_timestamp(self, minute: int) -> str:
+        return f"{self.date}T{MINUTE_LABELS[minute]}:00"
+
+    def timestamps(self) -> List[str]:
+        return [f"{self.date}T{MINUTE_LABELS[minute]}:00" for minute in self.minutes.tolist()]
+
+    def glucose_values(self) -> np.ndarray:
+        """Return values as float64 (NaN for notes).
+
+        float32 keeps glucose exact to two decimals (mg/dL integers, mmol/L tenths),
+        so rounding restores the values exactly as they were read from the CSV.
+        """
+        return np.round(self.values.astype(np.float64), 2)
+
+    def valid_rows(self) -> np.ndarray:
+        """Return indexes of rows with a glucose value"""
+        return np.flatnonzero(~np.isnan(self.values))
+
+    def has_valid_measurements(self) -> bool:
+        return bool(np.any(~np.isnan(self.values)))
+
+    def period_rows(self, period: HighGlucosePeriod) -> List[int]:
+        """Return rows of readings that belong to the period"""
+        valid_rows = self.valid_rows().tolist()
+        position = bisect.bisect_left(valid_rows, period.first_row)
+        return valid_rows[position:position + period.count]
+
+    def to_dict(self) -> dict:
+        """Return the processed JSON form of the day"""
+        glucose_values = self.glucose_values().tolist()
+        measurements = [
+            {
+                "timestamp": timestamp,
+                "glucose_value": None if value != value else value,
+                "note": self.notes.get(row)
+            }
+            for row, (timestamp, value) in enumerate(zip(self.timestamps(), glucose_values))
+        ]
+
+        valid_rows = self.valid_rows().tolist()
+        high_glucose_periods = []
+        for period in self.periods:
+            position = bisect.bisect_left(valid_rows, period.first_row)
+            first = measurements[period.first_row]
+            high_glucose_periods.append({
+                'start_time': first['timestamp'],
+                'start_value': first['glucose_value'],
+                'measurements': [measurements[row] for row in valid_rows[position:position + period.count]],
+                'points': period.points,
+                'end_time': self.minute_timestamp(period.end_minute),
+                'end_value': period.end_value
+            })
+
+        return {
+            "date": self.date,
+            "measurements": measurements,
+            "high_glucose_periods": high_glucose_periods
+        }
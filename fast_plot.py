@@ -0,0 +1,284 @@
+import json
+import sys
+from functools import lru_cache
+from typing import List
+import numpy as np
+from day_record import DayRecord
+
+# Default plot height in pixels (the same as the go.Figure layout)
+PLOT_HEIGHT = 300
+# Layout settings that are the same for every day; shared-layout pages define them once
+LAYOUT_DEFAULTS = {
+    'xaxis': {'title': {'text': ''}, 'tickformat': '%H:%M', 'type': 'date'},
+    'margin': {'l': 50, 'r': 50, 't': 20, 'b': 50},
+    'title': {'text': ''},
+    'height': PLOT_HEIGHT,
+    'showlegend': False,
+    'hovermode': 'x unified'
+}
+
+def plot_series(record: DayRecord) -> dict:
+    """Compute everything a day's plot shows: readings, notes, peak annotations, y range"""
+    all_timestamps = record.timestamps()
+    all_values = record.glucose_values()
+    valid_rows = record.valid_rows().tolist()
+
+    # Regular glucose measurements
+    timestamps = [all_timestamps[row] for row in valid_rows]
+    glucose_values = all_values[valid_rows].tolist()
+
+    # Notes data
+    note_rows = sorted(record.notes)
+    note_timestamps = [all_timestamps[row] for row in note_rows]
+    note_texts = [record.notes[row] for row in note_rows]
+
+    # Prepare annotations for peaks
+    annotations = []
+    for period in record.periods:
+        # Find the highest glucose value in this period
+        period_start = int(record.minutes[period.first_row])
+        first_row = int(np.searchsorted(record.minutes, period_start, side='left'))
+        last_row = int(np.searchsorted(record.minutes, period.end_minute, side='right'))
+        period_values = all_values[first_row:last_row]
+
+        if np.any(~np.isnan(period_values)):
+            peak_row = first_row + int(np.nanargmax(period_values))
+            annotations.append(dict(
+                x=all_timestamps[peak_row],
+                y=float(all_values[peak_row]),
+                text=str(int(period.points)),
+                showarrow=True,
+                arrowhead=0,
+                yshift=10,
+                font=dict(size=10, color='red'),
+                arrowcolor='red',
+                arrowsize=0.3,
+                arrowwidth=1
+            ))
+
+    # Calculate y-axis range
+    if glucose_values:
+        y_min = min(glucose_values)
+        y_max = max(glucose_values)
+
+        # Set default range [80, 180] unless data requires wider range
+        y_range = [
+            min(80, y_min) if y_min < 80 else 80,
+            max(180, y_max + 20) if y_max > 180 else 180  # Added +20 for annotations
+        ]
+    else:
+        y_range = [80, 180]  # Default range if no valid values
+
+    return {
+        'timestamps': timestamps,
+        'glucose_values': glucose_values,
+        'note_timestamps': note_timestamps,
+        'note_texts': note_texts,
+        'periods': [(all_timestamps[period.first_row], record.minute_timestamp(period.end_minute))
+                    for period in record.periods],
+        'annotations': annotations,
+        'y_range': y_range
+    }
+
+def figure_json(record: DayRecord, glucose_threshold: float) -> dict:
+    """Build the day's figure as plain Plotly JSON, without graph_objects validation.
+
+    Produces the same traces, shapes, annotations and layout as
+    report_generator.create_glucose_plot; the template is left out and shared
+    through template_script() instead.
+    """
+    series = plot_series(record)
+    data = [{
+        'hovertemplate': '%{x}<br>Glucose: %{y}<extra></extra>',
+        'line': {'color': 'blue'},
+        'marker': {'size': 8},
+        'mode': 'lines+markers',
+        'name': 'Glucose',
+        'x': series['timestamps'],
+        'y': series['glucose_values'],
+        'type': 'scatter'
+    }]
+    if series['note_timestamps']:
+        data.append({
+            'hovertemplate': '%{x}<br>Note: %{text}<extra></extra>',
+            'marker': {'color': 'red', 'size': 12, 'symbol': 'star-triangle-up'},
+            'mode': 'markers',
+            'name': 'Notes',
+            'text': series['note_texts'],
+            'x': series['note_timestamps'],
+            'y': [series['y_range'][0]] * len(series['note_timestamps']),
+            'type': 'scatter'
+        })
+
+    shapes = [
+        # Threshold line and baseline
+        {'line': {'color': 'red', 'dash': 'dash'}, 'type': 'line',
+         'x0': 0, 'x1': 1, 'xref': 'x domain', 'y0': glucose_threshold, 'y1': glucose_threshold, 'yref': 'y'},
+        {'line': {'color': 'black'}, 'type': 'line',
+         'x0': 0, 'x1': 1, 'xref': 'x domain', 'y0': 100, 'y1': 100, 'yref': 'y'}
+    ]
+    # Highlight high glucose periods
+    shapes.extend({'fillcolor': 'red', 'layer': 'below', 'line': {'width': 0}, 'opacity': 0.1, 'type': 'rect',
+                   'x0': start, 'x1': end, 'xref': 'x', 'y0': 0, 'y1': 1, 'yref': 'y domain'}
+                  for start, end in series['periods'])
+
+    layout = {
+        'shapes': shapes,
+        'annotations': series['annotations'],
+        'xaxis': LAYOUT_DEFAULTS['xaxis'],
+        'yaxis': {'title': {'text': ''}, 'range': series['y_range']},
+        'margin': LAYOUT_DEFAULTS['margin'],
+        'title': LAYOUT_DEFAULTS['title'],
+        'height': LAYOUT_DEFAULTS['height'],
+        'showlegend': LAYOUT_DEFAULTS['showlegend'],
+        'hovermode': LAYOUT_DEFAULTS['hovermode']
+    }
+    return {'data': data, 'layout': layout}
+
+def to_script_json(value) -> str:
+    """Serialize to compact JSON that is safe to embed in a <script> element"""
+    return (json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+            .replace('<', '\\u003c').replace('>', '\\u003e').replace('/', '\\u002f'))
+
+def figure_html(record: DayRecord, div_id: str, glucose_threshold: float, shared_layout: bool = False) -> str:
+    """Return a compact div with a single Plotly.newPlot call for the day.
+
+    Expects template_script() to be included once in the page, or with
+    shared_layout=True shared_layout_script(), in which case the LAYOUT_DEFAULTS
+    are left out of the day's layout.
+    """
+    figure = figure_json(record, glucose_threshold)
+    if shared_layout:
+        layout = {key: value for key, value in figure['layout'].items() if key not in LAYOUT_DEFAULTS}
+        layout_js = f'glucoseLayout({to_script_json(layout)})'
+    else:
+        layout_js = f'Object.assign({{template:window.GLUCOSE_PLOT_TEMPLATE}},{to_script_json(figure["layout"])})'
+    return (f'<div style="height:{PLOT_HEIGHT}px; width:100%;">'
+            f'<div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>'
+            f'<script>Plotly.newPlot("{div_id}",{to_script_json(figure["data"])},{layout_js},'
+            f'{{"responsive":true}});</script></div>')
+
+@lru_cache(maxsize=1)
+def plot_template() -> dict:
+    """Return the default Plotly template that go.Figure embeds in every figure"""
+    import plotly.io as pio
+    return pio.templates[pio.templates.default].to_plotly_json()
+
+def template_script() -> str:
+    """Return a <script> defining the shared plot template, included once per page"""
+    return f'<script>window.GLUCOSE_PLOT_TEMPLATE = {to_script_json(plot_template())};</script>'
+
+def shared_layout_script() -> str:
+    """Return JavaScript (without the <script> tag) defining the plot template, LAYOUT_DEFAULTS
+    and glucoseLayout(), which completes a day layout written by figure_html(shared_layout=True)"""
+    return (f'window.GLUCOSE_PLOT_TEMPLATE = {to_script_json(plot_template())};\n'
+            f'window.GLUCOSE_LAYOUT_DEFAULTS = {to_script_json(LAYOUT_DEFAULTS)};\n'
+            'window.glucoseLayout = function (layout) {\n'
+            '    // Plotly changes axis objects in place (e.g. on zoom), so every plot gets its own copy\n'
+            '    const defaults = JSON.parse(JSON.stringify(window.GLUCOSE_LAYOUT_DEFAULTS));\n'
+            '    return Object.assign({ template: window.GLUCOSE_PLOT_TEMPLATE }, defaults, layout);\n'
+            '};\n')
+
+def compare_with_figure(record: DayRecord) -> List[str]:
+    """Compare figure_json with the go.Figure built by create_glucose_plot.
+
+    Returns a list of differences in traces, shapes, annotations and layout
+    (empty when the two figures are equivalent).
+    """
+    from report_generator import GLUCOSE_THRESHOLD, create_glucose_plot
+    reference = json.loads(create_glucose_plot(record, GLUCOSE_THRESHOLD).to_json())
+    fast = json.loads(json.dumps(figure_json(record, GLUCOSE_THRESHOLD)))
+
+    differences = []
+    reference_layout = reference['layout']
+    if reference_layout.pop('template', None) != json.loads(json.dumps(plot_template())):
+        differences.append('template')
+    if len(reference['data']) != len(fast['data']):
+        differences.append(f"trace count: {len(reference['data'])} != {len(fast['data'])}")
+    for i, (expected, actual) in enumerate(zip(reference['data'], fast['data'])):
+        if expected != actual:
+            differences.append(f"trace {i}")
+    for key in ('shapes', 'annotations'):
+        if reference_layout.get(key, []) != fast['layout'].get(key, []):
+            differences.append(key)
+    rest = {key: value for key, value in reference_layout.items() if key not in ('shapes', 'annotations')}
+    if rest != {key: value for key, value in fast['layout'].items() if key not in ('shapes', 'annotations')}:
+        differences.append('layout')
+    return differences
+
+def synthetic_records(days: int = 14, seed: int = 0) -> List[DayRecord]:
+    """Days for the equivalence check that do not depend on data/processed.
+
+    Synthetic device history (readings, note rows between readings, gaps, meal
+    spikes giving several periods a day) plus edge cases: a period still open at
+    the end of the day, a day of note-only rows and a note on a reading.
+    """
+    from datetime import datetime
+    from glucose_analyzer import analyze_high_glucose_batch
+    from report_generator import GLUCOSE_THRESHOLD
+    from synthetic_data import generate_rows
+
+    by_date = {}
+    for timestamp, row in generate_rows(datetime(2024, 3, 1), days, seed):
+        # The same columns main.py reads: historic glucose and note
+        glucose_value = float(row[4]) if row[4] else None
+        note = row[13] or None
+        if glucose_value is not None or note:
+            by_date.setdefault(timestamp.strftime('%Y-%m-%d'), []).append({
+                'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:00'), 'glucose_value': glucose_value, 'note': note})
+
+    high = GLUCOSE_THRESHOLD + 60
+    by_date['2024-02-27'] = [
+        {'timestamp': '2024-02-27T08:00:00', 'glucose_value': 100.0, 'note': 'śniadanie'},
+        {'timestamp': '2024-02-27T22:30:00', 'glucose_value': high, 'note': None},
+        {'timestamp': '2024-02-27T22:40:00', 'glucose_value': None, 'note': 'kolacja'},
+        {'timestamp': '2024-02-27T22:45:00', 'glucose_value': high + 20, 'note': None},
+        {'timestamp': '2024-02-27T23:45:00', 'glucose_value': high, 'note': None},
+    ]
+    by_date['2024-02-28'] = [
+        {'timestamp': '2024-02-28T09:00:00', 'glucose_value': None, 'note': 'nowy sensor'},
+        {'timestamp': '2024-02-28T12:00:00', 'glucose_value': None, 'note': 'obiad'},
+    ]
+    records = [DayRecord.from_measurements(date, measurements) for date, measurements in sorted(by_date.items())]
+    for record, periods in zip(records, analyze_high_glucose_batch(records, GLUCOSE_THRESHOLD)):
+        record.periods = periods
+    return records
+
+def check_synthetic() -> int:
+    """Compare fast and graph_objects figures for synthetic_records(); return number of mismatching days.
+
+    Raises AssertionError if the records stop covering the cases the check is for.
+    """
+    from report_generator import GLUCOSE_THRESHOLD
+    records = synthetic_records()
+    assert any(len(record.periods) > 1 for record in records), 'no day with several periods'
+    assert any(record.periods and record.glucose_values()[record.valid_rows()[-1]] > GLUCOSE_THRESHOLD
+               for record in records if record.has_valid_measurements()), 'no period open at the end of a day'
+    assert any(record.notes and not record.has_valid_measurements() for record in records), 'no note-only day'
+    assert any(len(record.notes) > 0 and record.has_valid_measurements() for record in records), 'no notes'
+    mismatches = 0
+    for record in records:
+        differences = compare_with_figure(record)
+        if differences:
+            mismatches += 1
+            print(f"synthetic {record.date}: {', '.join(differences)}")
+    print(f"Compared {len(records)} synthetic day(s), {mismatches} mismatch(es)")
+    return mismatches
+
+def check_store(store_dir: str = 'data/processed') -> int:
+    """Compare fast and graph_objects figures for every stored day; return number of mismatching days"""
+    from glucose_store import GlucoseStore
+    from notes_manager import NotesManager
+    notes_manager = NotesManager()
+    mismatches = 0
+    for record in GlucoseStore(store_dir).read_range():
+        differences = compare_with_figure(notes_manager.apply_overrides(record))
+        if differences:
+            mismatches += 1
+            print(f"{record.date}: {', '.join(differences)}")
+    return mismatches
+
+if __name__ == '__main__':
+    # Visual-equivalence check of the fast renderer against go.Figure: synthetic days
+    # (always), then all stored days
+    sys.exit(1 if check_synthetic() + check_store(*sys.argv[1:]) else 0)
@@ -1,77 +1,211 @@
-from datetime import datetime
-from typing import List, Dict
+from typing import List, Optional
+import numpy as np
+from day_record import DayRecord, HighGlucosePeriod
 
 def analyze_high_glucose(measurements: list, glucose_threshold: float) -> list:
-    """Analyze periods of high glucose and calculate their severity"""
-    high_periods = []
-    current_period = None
-    
-    # Sort measurements by timestamp
-    sorted_measurements = sorted(measurements, key=lambda x: datetime.strptime(x['timestamp'], '%Y-%m-%dT%H:%M:00'))
-    
-    for i, measurement in enumerate(sorted_measurements):
-        if measurement['glucose_value'] is None:
-            continue
-            
-        is_high = measurement['glucose_value'] > glucose_threshold
-        current_time = datetime.strptime(measurement['timestamp'], '%Y-%m-%dT%H:%M:00')
-        
-        if is_high:
-            if current_period is None:
-                # Start new period
-                current_period = {
-                    'start_time': current_time.strftime('%Y-%m-%dT%H:%M:00'),
-                    'start_value': measurement['glucose_value'],
-                    'measurements': [measurement],
-                    'points': 0
-                }
+    """Analyze periods of high glucose and calculate their severity.
+
+    Takes one day's measurement dicts and returns periods in the processed JSON form.
+    """
+    if not measurements:
+        return []
+    record = DayRecord.from_measurements(measurements[0]['timestamp'][:10], measurements)
+    record.periods = analyze_high_glucose_batch([record], glucose_threshold)[0]
+    return record.to_dict()['high_glucose_periods']
+
+def analyze_high_glucose_batch(records: List[DayRecord], glucose_threshold: float) -> List[List[HighGlucosePeriod]]:
+    """Analyze high glucose periods for many days in a single vectorized pass.
+
+    Returns the periods of each record at the same position. Above-threshold runs
+    are found with array operations on the records' (already sorted) minute arrays.
+
+    A period ends at the first valid measurement that is not above the threshold and
+    every reading in it scores (glucose - threshold) * minutes until the next reading.
+    A period still open at the end of the day ends at its last reading, which scores
+    nothing. Readings without a glucose value (notes) are skipped, but - as before -
+    they can still supply `end_value` when they directly precede the closing reading
+    or are the last entry of the day.
+    """
+    results: List[List[HighGlucosePeriod]] = [[] for _ in records]
+    counts = np.array([len(record) for record in records], dtype=np.int64)
+    if counts.sum() == 0:
+        return results
+
+    day_ids = np.repeat(np.arange(len(records)), counts)
+    day_first_pos = np.cumsum(counts) - counts
+    day_last_pos = np.cumsum(counts) - 1
+    minutes = np.concatenate([record.minutes for record in records]).astype(np.int64)
+    values = np.concatenate([record.glucose_values() for record in records])
+
+    # Work on readings with a glucose value only
+    valid_pos = np.flatnonzero(~np.isnan(values))
+    if len(valid_pos) == 0:
+        return results
+    v_days = day_ids[valid_pos]
+    v_minutes = minutes[valid_pos]
+    v_values = values[valid_pos]
+    is_high = v_values > glucose_threshold
+
+    # Next valid reading of the same day (closing reading or next period member)
+    has_next = np.zeros(len(valid_pos), dtype=bool)
+    has_next[:-1] = v_days[1:] == v_days[:-1]
+    prev_high = np.zeros(len(valid_pos), dtype=bool)
+    prev_high[1:] = is_high[:-1] & has_next[:-1]
+    next_high = np.zeros(len(valid_pos), dtype=bool)
+    next_high[:-1] = is_high[1:] & has_next[:-1]
+
+    starts = np.flatnonzero(is_high & ~prev_high)
+    lasts = np.flatnonzero(is_high & ~next_high)
+    if len(starts) == 0:
+        return results
+    closed = has_next[lasts]
+
+    # Points: excess x duration for every reading followed by another reading that day
+    durations = np.zeros(len(valid_pos), dtype=np.float64)
+    durations[:-1] = (v_minutes[1:] - v_minutes[:-1]).astype(np.float64)
+    excess = (v_values - glucose_threshold) * durations
+    n_scored = lasts - starts + closed
+
+    # Sum each period left to right (the same floating point order as a plain loop);
+    # the loop runs over positions within a period, not over readings
+    points = np.zeros(len(starts), dtype=np.float64)
+    for k in range(int(n_scored.max())):
+        active = n_scored > k
+        points[active] += excess[starts[active] + k]
+
+    end_idx = np.where(closed, lasts + 1, lasts)
+    end_minutes = v_minutes[end_idx]
+    end_value_pos = np.where(closed, valid_pos[end_idx] - 1, day_last_pos[v_days[lasts]])
+    end_values = values[end_value_pos]
+    first_rows = valid_pos[starts] - day_first_pos[v_days[starts]]
+
+    for day, first_row, count, end_minute, end_value, n, period_points in zip(
+            v_days[starts].tolist(), first_rows.tolist(), (lasts - starts + 1).tolist(), end_minutes.tolist(),
+            end_values.tolist(), n_scored.tolist(), points.tolist()):
+        results[day].append(HighGlucosePeriod(
+            first_row, count, end_minute,
+            None if end_value != end_value else end_value,
+            round(period_points, 2) if n else 0
+        ))
+
+    return results
+
+def analyze_thresholds(records: List[DayRecord], thresholds: List[float]) -> List[dict]:
+    """Summarize high glucose periods of the records for many thresholds at once.
+
+    Returns for each threshold the number of periods, their points (as
+    analyze_high_glucose_batch would score them, before per-period rounding), the
+    minutes and readings above it. Values are sorted once; each threshold is then a
+    binary search into suffix sums:
+    - a reading above T starts a period unless the previous reading of the day is
+      above T too, so periods = #(v > T) - #(min(v, previous v) > T);
+    - every reading above T scores (v - T) * minutes to the next reading of the day
+      (nothing for the last one), so points = sum(v * d) - T * sum(d) over v > T.
+    """
+    if records:
+        minutes = np.concatenate([record.minutes for record in records]).astype(np.int64)
+        values = np.concatenate([record.glucose_values() for record in records])
+        day_ids = np.repeat(np.arange(len(records)), [len(record) for record in records])
+    else:
+        minutes, values, day_ids = np.zeros(0, np.int64), np.zeros(0), np.zeros(0, np.int64)
+    valid = ~np.isnan(values)
+    minutes, values, day_ids = minutes[valid], values[valid], day_ids[valid]
+
+    same_day = day_ids[1:] == day_ids[:-1]
+    durations = np.zeros(len(values), dtype=np.float64)
+    durations[:-1] = np.where(same_day, minutes[1:] - minutes[:-1], 0)
+    pair_minimums = np.sort(np.minimum(values[1:], values[:-1])[same_day])
+
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    # Suffix sums: element k holds the sum over sorted positions k and above
+    suffix_minutes = np.concatenate([np.cumsum(durations[order][::-1])[::-1], [0.0]])
+    suffix_weighted = np.concatenate([np.cumsum((values * durations)[order][::-1])[::-1], [0.0]])
+
+    threshold_array = np.asarray(thresholds, dtype=np.float64)
+    above = np.searchsorted(sorted_values, threshold_array, side='right')
+    pairs_above = np.searchsorted(pair_minimums, threshold_array, side='right')
+    results = []
+    for threshold, position, pair_position in zip(thresholds, above.tolist(), pairs_above.tolist()):
+        minutes_above = suffix_minutes[position]
+        results.append({
+            'threshold': threshold,
+            'periods': (len(values) - position) - (len(pair_minimums) - pair_position),
+            'points': round(float(suffix_weighted[position] - threshold * minutes_above), 2),
+            'minutes_above': int(minutes_above),
+            'readings_above': len(values) - position
+        })
+    return results
+
+class IncrementalAnalyzer:
+    """High glucose periods of one day, updated one reading at a time.
+
+    Gives exactly the periods of analyze_high_glucose_batch for the readings fed so
+    far: points are summed in the same order and the same end_value rules apply.
+    Each add() is O(1); readings must arrive in time order.
+    """
+
+    def __init__(self, date: str, glucose_threshold: float):
+        self.date = date
+        self.glucose_threshold = glucose_threshold
+        self.closed: List[HighGlucosePeriod] = []
+        self.rows = 0
+        self._last_minute = -1
+        self._last_row_value: Optional[float] = None     # value of the latest row (None for a note)
+        self._last_valid: Optional[tuple] = None          # (minute, value) of the latest valid reading
+        # Open period: [first_row, count, points, scored readings]
+        self._open: Optional[list] = None
+
+    @classmethod
+    def from_record(cls, record: DayRecord, glucose_threshold: float) -> 'IncrementalAnalyzer':
+        analyzer = cls(record.date, glucose_threshold)
+        for minute, value in zip(record.minutes.tolist(), record.glucose_values().tolist()):
+            analyzer.add(minute, value)
+        return analyzer
+
+    def add(self, minute: int, value: Optional[float]) -> Optional[HighGlucosePeriod]:
+        """Feed the next row of the day; return the period it opened, extended or closed"""
+        if minute < self._last_minute:
+            raise ValueError(f"Reading at minute {minute} is older than the previous one")
+        row = self.rows
+        self.rows += 1
+        self._last_minute = minute
+        previous_row_value = self._last_row_value
+        if value is not None and value != value:
+            value = None
+        self._last_row_value = value
+        if value is None:
+            return None
+
+        last_valid = self._last_valid
+        self._last_valid = (minute, value)
+        period = self._open
+        if period is not None:
+            # The previous reading of the period scores until this one
+            period[2] += (last_valid[1] - self.glucose_threshold) * float(minute - last_valid[0])
+            period[3] += 1
+        if value > self.glucose_threshold:
+            if period is None:
+                self._open = [row, 1, 0.0, 0]
             else:
-                # Continue current period
-                current_period['measurements'].append(measurement)
-        
-        elif current_period is not None:
-            # End current period
-            current_period['end_time'] = current_time.strftime('%Y-%m-%dT%H:%M:00')
-            current_period['end_value'] = sorted_measurements[i-1]['glucose_value']
-            
-            # Calculate points for the period
-            points = 0
-            for j in range(len(current_period['measurements'])):
-                current_value = current_period['measurements'][j]['glucose_value']
-                current_time = datetime.strptime(current_period['measurements'][j]['timestamp'], '%Y-%m-%dT%H:%M:00')
-                
-                # For the last measurement in period
-                if j == len(current_period['measurements']) - 1:
-                    next_time = datetime.strptime(measurement['timestamp'], '%Y-%m-%dT%H:%M:00')
-                else:
-                    next_time = datetime.strptime(current_period['measurements'][j+1]['timestamp'], '%Y-%m-%dT%H:%M:00')
-                
-                # Calculate minutes until next measurement
-                duration_minutes = (next_time - current_time).total_seconds() / 60
-                # Calculate points: excess glucose * duration
-                points += (current_value - glucose_threshold) * duration_minutes
-            
-            current_period['points'] = round(points, 2)
-            high_periods.append(current_period)
-            current_period = None
-    
-    # Handle case where period extends to the end of the day
-    if current_period is not None:
-        current_period['end_time'] = current_time.strftime('%Y-%m-%dT%H:%M:00')
-        current_period['end_value'] = measurement['glucose_value']
-        
-        # Calculate points for the last period
-        points = 0
-        for j in range(len(current_period['measurements'])):
-            current_value = current_period['measurements'][j]['glucose_value']
-            current_time = datetime.strptime(current_period['measurements'][j]['timestamp'], '%Y-%m-%dT%H:%M:00')
-            
-            if j < len(current_period['measurements']) - 1:
-                next_time = datetime.strptime(current_period['measurements'][j+1]['timestamp'], '%Y-%m-%dT%H:%M:00')
-                duration_minutes = (next_time - current_time).total_seconds() / 60
-                points += (current_value - glucose_threshold) * duration_minutes
-        
-        current_period['points'] = round(points, 2)
-        high_periods.append(current_period)
-    
-    return high_periods
+                period[1] += 1
+            return self.open_period()
+        if period is None:
+            return None
+        closed = HighGlucosePeriod(period[0], period[1], minute, previous_row_value, round(period[2], 2))
+        self.closed.append(closed)
+        self._open = None
+        return closed
+
+    def open_period(self) -> Optional[HighGlucosePeriod]:
+        """Return the period still open at the latest reading, as the batch analysis would end it"""
+        period = self._open
+        if period is None:
+            return None
+        return HighGlucosePeriod(period[0], period[1], self._last_valid[0], self._last_row_value,
+                                 round(period[2], 2) if period[3] else 0)
+
+    def periods(self) -> List[HighGlucosePeriod]:
+        """Return all periods of the day so far"""
+        open_period = self.open_period()
+        return self.closed + [open_period] if open_period is not None else list(self.closed)
@@ -0,0 +1,288 @@
+import bisect
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from day_record import DayRecord, HighGlucosePeriod, minute_of_day
+
+STORE_VERSION = 1
+
+class GlucoseStore:
+    """Columnar on-disk store of processed days.
+
+    Every day is one block in a memory-mapped data file: int32 minute offsets from
+    midnight followed by float32 glucose values (NaN where a row only has a note).
+    The index file maps dates to blocks and keeps the small per-day tables: notes
+    (row -> text) and high glucose periods (rows instead of copied measurements),
+    plus a content hash of the day (see block_id).
+
+    Rewritten days are appended as new blocks; the data file is compacted into a new
+    generation once more than half of it is garbage. The index is replaced atomically
+    and names its data file, so a reader never pairs an index with the wrong data.
+    Writers (main.py, live ingest) take an exclusive lock on glucose_store.lock, so
+    they never append to the same data file or replace each other's index.
+    """
+
+    def __init__(self, store_dir: str = 'data/processed'):
+        self.store_dir = store_dir
+        self.index_file = os.path.join(store_dir, 'glucose_store.json')
+        self.lock_file = os.path.join(store_dir, 'glucose_store.lock')
+        self.days: Dict[str, dict] = {}
+        self.data_file = 'glucose_store.0.bin'
+        self.generation = 0
+        self._dates: Optional[List[str]] = None
+        self._map: Optional[mmap.mmap] = None
+        self._map_file = None
+        self._index_mtime = None
+        self._lock_depth = 0
+        self.load()
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.store_dir, self.data_file)
+
+    def exists(self) -> bool:
+        """Check whether the store was ever written"""
+        return os.path.exists(self.index_file)
+
+    def load(self):
+        """Load the date index from disk if it exists"""
+        self._close_map()
+        self._dates = None
+        if not os.path.exists(self.index_file):
+            self.days = {}
+            self._index_mtime = None
+            return
+
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported store version in {self.index_file}: {index.get('version')}")
+        self.generation = index['generation']
+        self.data_file = index['data_file']
+        self.days = index['days']
+        self._index_mtime = os.stat(self.index_file).st_mtime_ns
+
+    def reload_if_changed(self) -> bool:
+        """Reload the index if another process replaced it; return True if it did"""
+        mtime = os.stat(self.index_file).st_mtime_ns if os.path.exists(self.index_file) else None
+        if mtime == self._index_mtime:
+            return False
+        self.load()
+        return True
+
+    def save_index(self):
+        """Atomically replace the index file"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            # dumps() uses the C encoder; dump() would encode in pure Python
+            f.write(json.dumps({
+                'version': STORE_VERSION,
+                'generation': self.generation,
+                'data_file': self.data_file,
+                'days': self.days
+            }, ensure_ascii=False, separators=(',', ':')))
+        os.replace(tmp_file, self.index_file)
+        self._index_mtime = os.stat(self.index_file).st_mtime_ns
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's write lock, waiting while another process holds it.
+
+        The index is reloaded once the lock is taken, so changes are made on top of
+        whatever the other process wrote. The lock is reentrant within an instance;
+        a read-modify-write of days should hold it across the read as well.
+        """
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                self.reload_if_changed()
+                yield
+            finally:
+                self._lock_depth = 0
+
+    def dates(self) -> List[str]:
+        """Return all stored dates in ascending order"""
+        if self._dates is None:
+            self._dates = sorted(self.days)
+        return self._dates
+
+    def dates_in_range(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Return stored dates between start and end (inclusive, 'YYYY-MM-DD')"""
+        dates = self.dates()
+        lo = bisect.bisect_left(dates, start) if start else 0
+        hi = bisect.bisect_right(dates, end) if end else len(dates)
+        return dates[lo:hi]
+
+    def write_days(self, records: Iterable[DayRecord]) -> List[str]:
+        """Append days to the store and update the index once.
+
+        Records are consumed one at a time, so a generator can be written without
+        holding all of it in memory. Returns the written dates.
+        """
+        with self.locked():
+            written = []
+            with open(self.data_path, 'ab') as f:
+                for record in records:
+                    self.days[record.date] = _write_block(f, record)
+                    written.append(record.date)
+            if written or not self.exists():
+                self._dates = None
+                self.save_index()
+            if self.garbage_bytes() > max(self.live_bytes(), 1024 * 1024):
+                self.compact()
+        return written
+
+    def live_bytes(self) -> int:
+        """Size of blocks referenced by the index"""
+        return sum(entry['count'] * 8 for entry in self.days.values())
+
+    def garbage_bytes(self) -> int:
+        """Size of blocks that were overwritten by newer versions of their day"""
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        return size - self.live_bytes()
+
+    def compact(self):
+        """Rewrite live blocks in date order into a new data file generation"""
+        with self.locked():
+            old_path = self.data_path
+            new_file = f'glucose_store.{self.generation + 1}.bin'
+            new_days = {}
+            with open(os.path.join(self.store_dir, new_file), 'wb') as f:
+                for date in self.dates():
+                    minutes, values = self._read_columns(date)
+                    entry = dict(self.days[date])
+                    entry['offset'] = f.tell()
+                    f.write(minutes.tobytes())
+                    f.write(values.tobytes())
+                    new_days[date] = entry
+            self._close_map()
+            self.generation += 1
+            self.data_file = new_file
+            self.days = new_days
+            self.save_index()
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _buffer(self, size: int) -> mmap.mmap:
+        """Return a read-only mapping of the data file covering at least size bytes"""
+        if self._map is None or self._map_file != self.data_file or len(self._map) < size:
+            self._close_map()
+            with open(self.data_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_file = self.data_file
+        return self._map
+
+    def _close_map(self):
+        # Arrays handed out by _read_columns may still point into the old mapping;
+        # dropping the reference lets it close once they are gone
+        self._map = None
+        self._map_file = None
+
+    def _read_columns(self, date: str):
+        """Return (minutes, values) arrays of a day, backed by the memory map"""
+        entry = self.days[date]
+        count = entry['count']
+        if count == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        buffer = self._buffer(entry['offset'] + count * 8)
+        minutes = np.frombuffer(buffer, dtype=np.int32, count=count, offset=entry['offset'])
+        values = np.frombuffer(buffer, dtype=np.float32, count=count, offset=entry['offset'] + count * 4)
+        return minutes, values
+
+    def block_id(self, date: str) -> Optional[str]:
+        """Identity of a day's current content, or None if the day is not stored.
+
+        Derived caches key their per-day entries by it: it changes whenever the day
+        is rewritten with different content, but not when compaction moves the block.
+        Entries written before it existed get it computed on first use.
+        """
+        entry = self.days.get(date)
+        if entry is None:
+            return None
+        if 'block_id' not in entry:
+            minutes, values = self._read_columns(date)
+            entry['block_id'] = _block_id(minutes, values, entry['notes'], entry['periods'])
+        return entry['block_id']
+
+    def read_day(self, date: str) -> DayRecord:
+        """Read one day; its arrays are read-only views of the memory map"""
+        minutes, values = self._read_columns(date)
+        entry = self.days[date]
+        return DayRecord(date, minutes, values, dict(entry['notes']),
+                         [HighGlucosePeriod(*period) for period in entry['periods']])
+
+    def read_range(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[DayRecord]:
+        """Read days between start and end (inclusive) without touching other days"""
+        for date in self.dates_in_range(start, end):
+            yield self.read_day(date)
+
+    def read_window(self, start: str, end: str) -> Tuple[List[str], List[float]]:
+        """Return timestamps and glucose values of readings between two 'YYYY-MM-DDTHH:MM:00'
+        timestamps (inclusive), also across midnight"""
+        timestamps, values = [], []
+        for record in self.read_range(start[:10], end[:10]):
+            first = int(np.searchsorted(record.minutes, minute_of_day(start))) if record.date == start[:10] else 0
+            last = (int(np.searchsorted(record.minutes, minute_of_day(end), side='right'))
+                    if record.date == end[:10] else len(record))
+            for row, value in zip(range(first, last), record.glucose_values()[first:last].tolist()):
+                if value == value:
+                    timestamps.append(record.timestamp(row))
+                    values.append(value)
+        return timestamps, values
+
+    def export_json(self, output_dir: str, start: Optional[str] = None, end: Optional[str] = None) -> int:
+        """Export days as per-day JSON files in the original processed format"""
+        os.makedirs(output_dir, exist_ok=True)
+        count = 0
+        for record in self.read_range(start, end):
+            with open(os.path.join(output_dir, f"{record.date}.json"), 'w', encoding='utf-8') as f:
+                json.dump(record.to_dict(), f, indent=2, ensure_ascii=False)
+            count += 1
+        return count
+
+    def import_json(self, json_dir: str) -> List[str]:
+        """Import per-day JSON files written by earlier versions"""
+        def legacy_days():
+            for filename in sorted(os.listdir(json_dir)):
+                if re.fullmatch(r'\d{4}-\d{2}-\d{2}\.json', filename):
+                    with open(os.path.join(json_dir, filename), 'r', encoding='utf-8') as f:
+                        yield DayRecord.from_dict(json.load(f))
+        return self.write_days(legacy_days())
+
+def _block_id(minutes: np.ndarray, values: np.ndarray, notes: list, periods: list) -> str:
+    """Hash of a day's columns and tables"""
+    digest = hashlib.blake2b(minutes.tobytes(), digest_size=8)
+    digest.update(values.tobytes())
+    digest.update(json.dumps([notes, periods], ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+def _write_block(f, record: DayRecord) -> dict:
+    """Write a day's columns at the end of the data file and return its index entry"""
+    minutes = record.minutes.astype(np.int32)
+    values = record.values.astype(np.float32)
+    entry = {
+        'offset': f.tell(),
+        'count': len(record),
+        'notes': sorted(record.notes.items()),
+        'periods': [period.to_list() for period in record.periods]
+    }
+    entry['block_id'] = _block_id(minutes, values, entry['notes'], entry['periods'])
+    f.write(minutes.tobytes())
+    f.write(values.tobytes())
+    return entry
@@ -0,0 +1,112 @@
+import argparse
+from datetime import date as date_type, timedelta
+from typing import Dict, Optional, Sequence
+import numpy as np
+from glucose_store import GlucoseStore
+from rollups import DAILY_COLUMNS, RollupStore
+
+# Consensus glucose ranges in mg/dL (inclusive integer bounds, as LibreLink reports whole mg/dL)
+GLUCOSE_RANGES = {
+    'very_low': (0, 53),
+    'low': (54, 69),
+    'in_range': (70, 180),
+    'high': (181, 250),
+    'very_high': (251, None),
+}
+# Percentile bands of the ambulatory glucose profile
+AGP_PERCENTILES = (5, 25, 50, 75, 95)
+
+def histogram_percentiles(histogram: np.ndarray, percentiles: Sequence[float]) -> np.ndarray:
+    """Percentiles of the values counted in 1 mg/dL histograms (last axis), interpolated like numpy's default.
+
+    Exact for whole mg/dL readings. Rows without readings give NaN.
+    """
+    histogram = np.atleast_2d(histogram)
+    cumulative = np.cumsum(histogram, axis=-1)
+    totals = cumulative[:, -1:]
+    last_rank = np.maximum(totals - 1, 0)
+    ranks = np.asarray(percentiles, dtype=np.float64) / 100 * last_rank
+    lower_rank = np.floor(ranks)
+    upper_rank = np.minimum(lower_rank + 1, last_rank)
+    # The value at sorted position k is the first bin whose cumulative count exceeds k
+    lower = (cumulative[:, None, :] <= lower_rank[:, :, None]).sum(axis=-1)
+    upper = (cumulative[:, None, :] <= upper_rank[:, :, None]).sum(axis=-1)
+    result = lower + (upper - lower) * (ranks - lower_rank)
+    result[totals[:, 0] == 0] = np.nan
+    return result
+
+def range_statistics(rollups: RollupStore, start: Optional[str] = None, end: Optional[str] = None) -> Dict:
+    """Glycemic statistics of the days between start and end (inclusive), from the day rollups.
+
+    Mean, standard deviation and CV come from per-day sums, time in ranges and
+    percentiles from the merged per-day histograms, so no readings are read again.
+    Time in ranges is the share of readings in each range, in percent.
+    """
+    dates, daily = rollups.daily(start, end)
+    histogram = rollups.histogram(start, end)
+    column = {name: i for i, name in enumerate(DAILY_COLUMNS)}
+    count = int(daily[:, column['count']].sum())
+    result = {
+        'from': start if start is not None else (dates[0] if dates else None),
+        'to': end if end is not None else (dates[-1] if dates else None),
+        'days': int((daily[:, column['count']] > 0).sum()),
+        'readings': count,
+    }
+    if not count:
+        return result
+
+    mean = daily[:, column['sum']].sum() / count
+    variance = max(daily[:, column['sum_squares']].sum() / count - mean * mean, 0.0)
+    sd = variance ** 0.5
+    totals = histogram.sum(axis=0)
+    time_in_ranges = {}
+    for name, (low, high) in GLUCOSE_RANGES.items():
+        in_range = totals[low:None if high is None else high + 1].sum()
+        time_in_ranges[name] = round(float(in_range) / count * 100, 1)
+
+    percentiles = histogram_percentiles(totals, AGP_PERCENTILES)[0]
+    agp = histogram_percentiles(histogram, AGP_PERCENTILES)
+    result.update({
+        'mean': round(mean, 1),
+        'sd': round(sd, 1),
+        'cv': round(sd / mean * 100, 1) if mean else None,
+        # Glucose management indicator (%), estimated HbA1c from the mean in mg/dL
+        'gmi': round(3.31 + 0.02392 * mean, 1),
+        'time_in_ranges': time_in_ranges,
+        'percentiles': {str(p): round(float(value), 1) for p, value in zip(AGP_PERCENTILES, percentiles)},
+        # Hour of day -> percentile bands, None for hours without readings
+        'agp': {str(p): [None if value != value else round(value, 1) for value in agp[:, i].tolist()]
+                for i, p in enumerate(AGP_PERCENTILES)}
+    })
+    return result
+
+def last_days_range(store: GlucoseStore, days: int):
+    """Return (start, end) of the last `days` calendar days ending on the newest stored day"""
+    dates = store.dates()
+    if not dates:
+        return None, None
+    end = dates[-1]
+    start = (date_type.fromisoformat(end) - timedelta(days=days - 1)).isoformat()
+    return start, end
+
+def main():
+    parser = argparse.ArgumentParser(description='Print glycemic statistics (TIR, GMI, CV, percentiles) of the processed store')
+    parser.add_argument('--days', type=int, default=14, help='last N days of data (default: 14)')
+    parser.add_argument('--from', dest='start', help='first day, YYYY-MM-DD (instead of --days)')
+    parser.add_argument('--to', dest='end', help='last day, YYYY-MM-DD (instead of --days)')
+    args = parser.parse_args()
+
+    store = GlucoseStore()
+    rollups = RollupStore()
+    rollups.sync(store)
+    start, end = (args.start, args.end) if args.start or args.end else last_days_range(store, max(1, args.days))
+    stats = range_statistics(rollups, start, end)
+    print(f"{stats['from']} - {stats['to']}: {stats['days']} day(s), {stats['readings']} reading(s)")
+    if not stats['readings']:
+        return
+    print(f"Mean {stats['mean']} mg/dL, SD {stats['sd']}, CV {stats['cv']}%, GMI {stats['gmi']}%")
+    print('Time in ranges: ' + ', '.join(f"{name} {share}%" for name, share in stats['time_in_ranges'].items()))
+    print('Percentiles: ' + ', '.join(f"p{p} {value:g}" for p, value in stats['percentiles'].items()))
+
+if __name__ == "__main__":
+    main()
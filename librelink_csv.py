@@ -0,0 +1,11 @@
+# Column names of a LibreLink export (Polish version); row[2] is the timestamp,
+# row[4] the historic glucose value and row[13] the note
+LIBRELINK_COLUMNS = [
+    'Urządzenie', 'Numer seryjny', 'Znacznik czasu w urządzeniu', 'Typ rekordu',
+    'Historyczny poziom glukozy mg/dL', 'Skan poziomu glukozy mg/dL',
+    'Insulina szybko działająca bez wartości liczbowej', 'Insulina szybko działająca (jednostki)',
+    'Pokarm bez wartości liczbowej', 'Węglowodany (gramy)', 'Węglowodany (porcje)',
+    'Insulina długo działająca bez wartości liczbowej', 'Insulina długo działająca (jednostki)',
+    'Notatki', 'Paski do oznaczania glukozy mg/dL', 'Ketony mmol/L', 'Insulina posiłkowa (jednostki)',
+    'Insulina korekcyjna (jednostki)', 'Zmiana insuliny przez użytkownika (jednostki)'
+]
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import requests
+from glucose_analyzer import analyze_high_glucose_batch
+from glucose_store import GlucoseStore
+from rollups import RollupStore
+from day_record import DayRecord, minute_of_day
+from librelink_csv import LIBRELINK_COLUMNS
+
+# Load configuration
+with open('config.json', 'r') as f:
+    config = json.load(f)
+    GLUCOSE_THRESHOLD = config['glucose_threshold']
+
+# Live readings are also kept here as LibreLink-format exports, so main.py merges them
+# like any other source and rebuilding their days does not drop them. There is one
+# file per day of readings: only the newest one changes, so main.py re-merges just
+# the days it covers instead of every day ever polled.
+LIVE_READINGS_DIR = 'data/source'
+
+def live_readings_file(live_dir: str, date: str) -> str:
+    """Path of the live readings file of a day ('YYYY-MM-DD')"""
+    return os.path.join(live_dir, f"librelinkup_live_{date}.csv")
+
+class RateLimitError(requests.HTTPError):
+    """HTTP 429 from a readings source; retry_after is the server's Retry-After in seconds (or None)"""
+
+    def __init__(self, message: str, retry_after: Optional[float], response: requests.Response):
+        super().__init__(message, response=response)
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def raise_for_status(response: requests.Response):
+    """Like response.raise_for_status(), but a 429 raises RateLimitError carrying Retry-After"""
+    if response.status_code == 429:
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        raise RateLimitError(f"429 Too Many Requests for url: {response.url}", retry_after, response)
+    response.raise_for_status()
+
+class JsonHttpClient:
+    """Readings source that GETs a JSON list of readings from a URL.
+
+    Expects [{"timestamp": "YYYY-MM-DDTHH:MM:00", "glucose_value": 123.0}, ...] and
+    passes the last stored timestamp as ?since=. Used with a local stand-in server
+    or a bridge in front of another CGM service.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url
+        self.timeout = timeout
+        # One session, so the connection is kept alive between polls
+        self.session = requests.Session()
+
+    def fetch_readings(self, since: Optional[str]) -> List[dict]:
+        params = {'since': since} if since else None
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        raise_for_status(response)
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+class LibreLinkUpClient:
+    """Readings source backed by the LibreLinkUp API (graph data, about the last 12 hours).
+
+    Logs in through pylibrelinkup, then polls the graph endpoint over a single
+    keep-alive session. An expired token is renewed once per fetch.
+    """
+
+    def __init__(self, email: str, password: str, region: str = 'EU', patient_id: Optional[str] = None,
+                 api_url: Optional[str] = None, timeout: float = 30.0):
+        from pylibrelinkup import APIUrl, PyLibreLinkUp
+        self.api = PyLibreLinkUp(email=email, password=password, api_url=APIUrl.from_string(region))
+        if api_url:
+            self.api.api_url = api_url.rstrip('/')
+        self.patient_id = patient_id
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _graph(self) -> dict:
+        if self.api.token is None:
+            self.api.authenticate()
+        if self.patient_id is None:
+            self.patient_id = str(self.api.get_patients()[0].patient_id)
+        response = self.session.get(f"{self.api.api_url}/llu/connections/{self.patient_id}/graph",
+                                    headers=self.api._get_headers(), timeout=self.timeout)
+        # The graph request bypasses pylibrelinkup's _call_api, so rate limits are mapped here
+        raise_for_status(response)
+        return response.json()
+
+    def fetch_readings(self, since: Optional[str]) -> List[dict]:
+        from pylibrelinkup import GraphResponse
+        try:
+            graph = GraphResponse.model_validate(self._graph())
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 401:
+                raise
+            self.api.token = None
+            graph = GraphResponse.model_validate(self._graph())
+        # Only the 15-minute history, like the historic readings of an export; graph.current
+        # is a minute-by-minute value that would become the last timestamp and make the
+        # next history point look older than it
+        return [{'timestamp': m.timestamp.strftime('%Y-%m-%dT%H:%M:00'),
+                 'glucose_value': float(m.value_in_mg_per_dl)}
+                for m in graph.history]
+
+    def close(self):
+        self.session.close()
+
+def retry_delay(error: Exception, failures: int, poll_interval: float, max_backoff: float) -> float:
+    """Exponential backoff with jitter; honours Retry-After of rate-limit errors.
+
+    RateLimitError (graph and JSON polls) and pylibrelinkup's LLUAPIRateLimitError
+    (login, patient list) both carry retry_after.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return float(retry_after)
+    delay = min(max_backoff, poll_interval * 2 ** failures)
+    return delay * random.uniform(0.5, 1.0)
+
+def append_live_readings(path: str, readings: List[Tuple[str, Optional[float]]]):
+    """Append (timestamp, glucose value) pairs to the live readings file as historic readings.
+
+    The file has a single header line and no generation date, so main.py orders it
+    among the exports by its modification time (the YYYY-MM-DD date in its name does
+    not match the DD-MM-YYYY export file names).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new_file = not os.path.exists(path)
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(LIBRELINK_COLUMNS)
+        for timestamp, value in readings:
+            row = [''] * len(LIBRELINK_COLUMNS)
+            row[0] = 'LibreLinkUp'
+            row[2] = f"{timestamp[8:10]}-{timestamp[5:7]}-{timestamp[:4]} {timestamp[11:16]}"
+            row[3] = '0'
+            row[4] = '' if value is None else f"{value:g}"
+            writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+
+class LiveIngester:
+    """Poll a readings client and append new readings to the processed store.
+
+    Only readings newer than the last stored timestamp are taken. The days they
+    fall on (normally just today) are re-analyzed and written as new blocks, and
+    their rollups updated; other days are not touched. Any object with fetch_readings(since) returning reading
+    dicts can be used as the client.
+
+    New readings are first appended to the live readings file of their day in live_dir
+    (LIVE_READINGS_DIR by default, None to disable), a source main.py merges with the
+    CSV exports, so a later rebuild of their days keeps them. The store lock is held
+    from reading the last day to writing it, so this can run next to main.py.
+    """
+
+    def __init__(self, client, store: Optional[GlucoseStore] = None, poll_interval: float = 60.0,
+                 max_backoff: float = 900.0, threshold: float = GLUCOSE_THRESHOLD,
+                 live_dir: Optional[str] = LIVE_READINGS_DIR):
+        self.client = client
+        self.live_dir = live_dir
+        self.store = store if store is not None else GlucoseStore()
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.threshold = threshold
+        self.store.reload_if_changed()
+        self.rollups = RollupStore(self.store.store_dir)
+
+    def last_timestamp(self) -> Optional[str]:
+        """Timestamp of the latest stored reading"""
+        dates = self.store.dates()
+        if not dates:
+            return None
+        record = self.store.read_day(dates[-1])
+        if not len(record):
+            return None
+        return record.timestamp(len(record) - 1)
+
+    def append_readings(self, readings: List[dict]) -> List[str]:
+        """Append readings newer than the store's last timestamp; return the written dates"""
+        with self.store.locked():
+            last = self.last_timestamp()
+            delta: Dict[str, float] = {}
+            for reading in readings:
+                timestamp = reading['timestamp']
+                if last is None or timestamp > last:
+                    delta[timestamp] = reading.get('glucose_value')
+            if not delta:
+                return []
+
+            by_date: Dict[str, List[str]] = {}
+            for timestamp in sorted(delta):
+                by_date.setdefault(timestamp[:10], []).append(timestamp)
+            if self.live_dir:
+                for date, timestamps in by_date.items():
+                    append_live_readings(live_readings_file(self.live_dir, date),
+                                         [(timestamp, delta[timestamp]) for timestamp in timestamps])
+
+            records = []
+            for date, timestamps in by_date.items():
+                minutes = np.array([minute_of_day(timestamp) for timestamp in timestamps], dtype=np.int32)
+                values = np.array([np.nan if delta[t] is None else delta[t] for t in timestamps], dtype=np.float32)
+                if date in self.store.days:
+                    # New readings are all later than the stored ones, so the rows stay sorted
+                    stored = self.store.read_day(date)
+                    record = DayRecord(date, np.concatenate([stored.minutes, minutes]),
+                                       np.concatenate([stored.values, values]), dict(stored.notes))
+                else:
+                    record = DayRecord(date, minutes, values)
+                records.append(record)
+
+            for record, periods in zip(records, analyze_high_glucose_batch(records, self.threshold)):
+                record.periods = periods
+            written = self.store.write_days(records)
+            self.rollups.sync(self.store)
+            return written
+
+    async def poll_once(self) -> int:
+        """Fetch and append one batch; return the number of days written"""
+        readings = await asyncio.to_thread(self.client.fetch_readings, self.last_timestamp())
+        written = await asyncio.to_thread(self.append_readings, readings)
+        if written:
+            print(f"Appended readings for {', '.join(written)}")
+        return len(written)
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """Poll until stop is set, backing off after failures"""
+        stop = stop or asyncio.Event()
+        failures = 0
+        while not stop.is_set():
+            try:
+                await self.poll_once()
+                failures = 0
+                delay = self.poll_interval
+            except Exception as e:
+                delay = retry_delay(e, failures, self.poll_interval, self.max_backoff)
+                failures += 1
+                print(f"Polling failed ({e}), retrying in {delay:.0f}s")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll live glucose readings and append them to the processed store')
+    parser.add_argument('--interval', type=float, default=60.0, metavar='SECONDS',
+                        help='seconds between polls (default: 60)')
+    parser.add_argument('--url', help='poll a JSON readings endpoint at URL instead of LibreLinkUp')
+    args = parser.parse_args()
+
+    if args.url:
+        client = JsonHttpClient(args.url)
+    else:
+        # Credentials are read from the environment or a .env file
+        from dotenv import load_dotenv
+        load_dotenv()
+        client = LibreLinkUpClient(os.environ['LIBRELINKUP_EMAIL'], os.environ['LIBRELINKUP_PASSWORD'],
+                                   region=os.environ.get('LIBRELINKUP_REGION', 'EU'),
+                                   patient_id=os.environ.get('LIBRELINKUP_PATIENT_ID'))
+    try:
+        asyncio.run(LiveIngester(client, poll_interval=args.interval).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
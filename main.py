@@ -1,104 +1,426 @@
 import os
 import json
 import csv
+import re
+import argparse
+import heapq
+import itertools
+import pickle
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional
-from glucose_analyzer import analyze_high_glucose
+from functools import lru_cache
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+from glucose_analyzer import analyze_high_glucose_batch
+from manifest import IngestManifest
+from glucose_store import GlucoseStore
+from rollups import RollupStore
+from note_index import NoteIndex
+from meal_response import MealResponseCache
+from notes_manager import NotesManager
+from day_record import DayRecord
+from librelink_csv import LIBRELINK_COLUMNS
+from metrics import metrics
 
 # Load configuration
 with open('config.json', 'r') as f:
     config = json.load(f)
     GLUCOSE_THRESHOLD = config['glucose_threshold']
 
-def process_csv_file(csv_path: str) -> Dict[str, List[dict]]:
-    """Process CSV file and return measurements grouped by date"""
-    measurements_by_date = {}
-    
+# Days per analyze_high_glucose_batch call; bounds the memory of a batch
+ANALYZE_BATCH_DAYS = 32
+
+@lru_cache(maxsize=4096)
+def _parse_date(date_part: str) -> str:
+    """Convert 'DD-MM-YYYY' to 'YYYY-MM-DD' (cached - an export has few distinct dates)"""
+    return datetime.strptime(date_part, '%d-%m-%Y').strftime('%Y-%m-%d')
+
+@lru_cache(maxsize=2048)
+def _parse_time(time_part: str) -> str:
+    """Validate and normalize 'HH:MM' (cached - there are only 1440 minutes in a day)"""
+    return datetime.strptime(time_part, '%H:%M').strftime('%H:%M')
+
+def parse_timestamp(timestamp_str: str) -> str:
+    """Convert LibreLink 'DD-MM-YYYY HH:MM' timestamp to 'YYYY-MM-DDTHH:MM:00'"""
+    date_part, sep, time_part = timestamp_str.partition(' ')
+    if sep and len(date_part) == 10 and len(time_part) == 5:
+        return f"{_parse_date(date_part)}T{_parse_time(time_part)}:00"
+    # Unusual formatting (e.g. no zero padding) - fall back to the full parser
+    timestamp = datetime.strptime(timestamp_str, '%d-%m-%Y %H:%M')
+    return timestamp.strftime('%Y-%m-%dT%H:%M:00')
+
+def export_date(csv_path: str) -> str:
+    """Return when a LibreLink export was generated ('YYYY-MM-DDTHH:MM:00'), to order overlapping sources.
+
+    Taken from the first header line ('Dane glukozy,Wygenerowano dnia,DD-MM-YYYY HH:MM UTC,...'),
+    else from the date in the file name ('*_glucose_DD-MM-YYYY.csv'), else from the
+    file's modification time. File names alone do not sort by date in this format.
+    """
+    with open(csv_path, 'r', encoding='utf-8-sig') as file:
+        header = next(csv.reader(file), [])
+    if len(header) > 2:
+        try:
+            return parse_timestamp(header[2][:16])
+        except ValueError:
+            pass
+    match = re.search(r'(\d{2})-(\d{2})-(\d{4})', os.path.basename(csv_path))
+    if match:
+        day, month, year = match.groups()
+        return f"{year}-{month}-{day}T00:00:00"
+    return datetime.fromtimestamp(os.path.getmtime(csv_path)).strftime('%Y-%m-%dT%H:%M:00')
+
+def iter_measurements(csv_path: str) -> Iterator[dict]:
+    """Stream measurements from a LibreLink CSV file, one row at a time"""
     with open(csv_path, 'r', encoding='utf-8-sig') as file:
         reader = csv.reader(file)
-        next(reader)  # Skip header row with column names
-        
+        next(reader, None)  # Skip header row with column names
+
         for row in reader:
             # Skip empty rows or rows without enough columns
             if not row or len(row) < 14:
                 continue
-                
+
             # Skip if timestamp column is empty or contains header
-            if not row[2] or row[2] == 'Znacznik czasu w urządzeniu':
+            if not row[2] or row[2] == LIBRELINK_COLUMNS[2]:
                 continue
-                
+
             try:
-                timestamp_str = row[2]  # Column C contains timestamp
-                timestamp = datetime.strptime(timestamp_str, '%d-%m-%Y %H:%M')
-                date_str = timestamp.strftime('%Y-%m-%d')
-                
+                timestamp = parse_timestamp(row[2])  # Column C contains timestamp
+
                 # Get glucose value and note
                 glucose_value = float(row[4]) if row[4] else None
                 note = row[13] if row[13] else None
-                
+
                 # Skip empty records (no glucose value and no note)
                 if glucose_value is None and not note:
                     continue
-                
-                measurement = {
-                    "timestamp": timestamp.strftime('%Y-%m-%dT%H:%M:00'),
+
+                yield {
+                    "timestamp": timestamp,
                     "glucose_value": glucose_value,
                     "note": note
                 }
-                
-                if date_str not in measurements_by_date:
-                    measurements_by_date[date_str] = {
-                        "date": date_str,
-                        "measurements": [],
-                        "high_glucose_periods": []
-                    }
-                
-                measurements_by_date[date_str]["measurements"].append(measurement)
-                
+
             except (ValueError, IndexError) as e:
                 print(f"Error processing row: {e}")
                 continue
-    
-    # Analyze high glucose periods for each day
-    for date, data in measurements_by_date.items():
-        if data["measurements"]:
-            data["high_glucose_periods"] = analyze_high_glucose(data["measurements"], GLUCOSE_THRESHOLD)
-    
-    return measurements_by_date
-
-def save_json_files(measurements_by_date: Dict[str, List[dict]], output_dir: str):
-    """Save measurements to separate JSON files by date, only for days with measurements"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    for date, data in measurements_by_date.items():
-        # Save only if there are any measurements for this day
-        if data["measurements"]:
-            output_path = os.path.join(output_dir, f"{date}.json")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            
-def process_csv_files():
-    """Process all CSV files in the source directory"""
+
+def iter_days(measurements: Iterable[dict], max_open_days: int = 2) -> Iterator[dict]:
+    """Group a stream of measurements into days, emitting each day once the date rolls over.
+
+    A few days are kept open so readings slightly out of order around midnight still
+    land in their day. A date that reappears after it was emitted is emitted again
+    as a separate fragment - the consumer is responsible for merging it.
+    """
+    open_days: 'OrderedDict[str, dict]' = OrderedDict()
+    for measurement in measurements:
+        date_str = measurement["timestamp"][:10]
+        day = open_days.get(date_str)
+        if day is None:
+            if len(open_days) >= max_open_days:
+                yield open_days.popitem(last=False)[1]
+            day = open_days[date_str] = {
+                "date": date_str,
+                "measurements": [],
+                "high_glucose_periods": []
+            }
+        else:
+            open_days.move_to_end(date_str)
+        day["measurements"].append(measurement)
+
+    yield from open_days.values()
+
+def _sorted_fragment(measurements: List[dict]) -> List[dict]:
+    """Sort a day fragment by timestamp unless it already is"""
+    if any(a["timestamp"] > b["timestamp"] for a, b in zip(measurements, measurements[1:])):
+        measurements.sort(key=itemgetter("timestamp"))
+    return measurements
+
+def spill_csv_file(csv_path: str, spill_path: str, days: Optional[Set[str]] = None) -> Tuple[List[str], bool]:
+    """Parse a CSV file once, spilling its readings sorted by timestamp to spill_path.
+
+    Returns the days covered by the file and whether they come in date order. A file
+    is in order when iter_days emits every date once and in ascending order (readings
+    within a day may be shuffled); its days are written out one by one as they are
+    parsed. Other files are sorted in memory before they are written. The spill holds
+    one pickled list of readings per day and is read back by iter_spilled_readings,
+    so a changed file is parsed only once even though its days are known only at the end.
+    With days given only readings of those days are spilled.
+    """
+    found = set()
+    last_date = None
+    in_order = True
+    held = []
+    with open(spill_path, 'wb') as spill:
+        for data in metrics.timed('parse', iter_days(iter_measurements(csv_path))):
+            if in_order and last_date is not None and data["date"] <= last_date:
+                in_order = False
+            last_date = data["date"]
+            found.add(data["date"])
+            if days is not None and data["date"] not in days:
+                continue
+            if in_order:
+                pickle.dump(_sorted_fragment(data["measurements"]), spill, pickle.HIGHEST_PROTOCOL)
+            else:
+                held.extend(data["measurements"])
+    if not in_order:
+        # Rewrite everything sorted, including the days written before the disorder showed up
+        held.extend(iter_spilled_readings(spill_path))
+        held.sort(key=itemgetter("timestamp"))
+        with open(spill_path, 'wb') as spill:
+            for _, measurements in itertools.groupby(held, key=lambda m: m["timestamp"][:10]):
+                pickle.dump(list(measurements), spill, pickle.HIGHEST_PROTOCOL)
+    return sorted(found), in_order
+
+def iter_spilled_readings(spill_path: str) -> Iterator[dict]:
+    """Stream readings back from a file written by spill_csv_file, one day at a time"""
+    with open(spill_path, 'rb') as spill:
+        while True:
+            try:
+                measurements = pickle.load(spill)
+            except EOFError:
+                return
+            yield from measurements
+
+def iter_file_readings(csv_path: str, days: Set[str], in_order: bool) -> Iterator[dict]:
+    """Yield readings of the given days from a CSV file, sorted by timestamp.
+
+    Files in date order are streamed one day at a time; other files are loaded and
+    sorted in memory.
+    """
+    day_fragments = (data["measurements"] for data in metrics.timed('parse', iter_days(iter_measurements(csv_path)))
+                     if data["date"] in days)
+    if not in_order:
+        readings = [m for measurements in day_fragments for m in measurements]
+        readings.sort(key=itemgetter("timestamp"))
+        yield from readings
+        return
+
+    for measurements in day_fragments:
+        yield from _sorted_fragment(measurements)
+
+def merge_readings(streams: List[Iterable[dict]]) -> Iterator[dict]:
+    """K-way merge of sorted reading streams with deduplication by timestamp.
+
+    Streams are ordered oldest export first (see export_date). Readings sharing a
+    timestamp collapse into one: the glucose value comes from the newest export that
+    has one, and every distinct note is kept (joined with '; ' in export order), so a
+    reading with a note is never replaced by one without it.
+    """
+    merged = heapq.merge(*streams, key=itemgetter("timestamp"))
+    for timestamp, group in itertools.groupby(merged, key=itemgetter("timestamp")):
+        group = list(group)
+        if len(group) == 1:
+            yield group[0]
+            continue
+        glucose_value = next((m["glucose_value"] for m in reversed(group) if m["glucose_value"] is not None), None)
+        notes = list(dict.fromkeys(m["note"] for m in group if m["note"]))
+        yield {
+            "timestamp": timestamp,
+            "glucose_value": glucose_value,
+            "note": "; ".join(notes) if notes else None
+        }
+
+def iter_merged_days(readings: Iterable[dict]) -> Iterator[DayRecord]:
+    """Group a sorted stream of readings into day records; every date is emitted exactly once"""
+    for date_str, measurements in itertools.groupby(readings, key=lambda m: m["timestamp"][:10]):
+        yield DayRecord.from_measurements(date_str, list(measurements))
+
+def analyze_days(records: List[DayRecord]) -> List[DayRecord]:
+    """Fill in high glucose periods for a batch of days"""
+    periods = analyze_high_glucose_batch(records, GLUCOSE_THRESHOLD)
+    for record, day_periods in zip(records, periods):
+        record.periods = day_periods
+    return records
+
+def map_in_pool(func: Callable, tasks: Iterable[tuple], workers: int) -> Iterator:
+    """Run func(*task) for every task in a process pool, yielding results in task order.
+
+    Only a few tasks per worker are in flight, so finished results do not pile up
+    in memory while the consumer handles earlier ones.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(tasks)
+        pending = deque(executor.submit(func, *task) for task in itertools.islice(remaining, workers * 2))
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(executor.submit(func, *task) for task in itertools.islice(remaining, 1))
+            yield result
+
+def process_csv_files(full: bool = False, workers: int = 1, chunk_size: int = 8, fast_render: bool = False,
+                      report: bool = True, bundle_dir: Optional[str] = None):
+    """Process new or changed CSV files in the source directory.
+
+    Unchanged files (according to the ingest manifest) are skipped. Every day touched
+    by a changed file is rebuilt by merging the readings of all files covering it, and
+    written once. With full=True all files are processed again.
+
+    With workers > 1 files are parsed and days analyzed in a process pool; the
+    merge and writes stay in order in this process, so the output is identical to a
+    serial run. The report is rendered by the same number of workers, chunk_size days
+    per task; fast_render selects the fast plot serializer. With bundle_dir the report
+    is written there as a self-contained bundle instead. Days of removed source
+    files are kept as they are. With report=False only the store is updated.
+    """
     source_dir = 'data/source'
     processed_dir = 'data/processed'
     os.makedirs(source_dir, exist_ok=True)
     os.makedirs(processed_dir, exist_ok=True)
 
-    # Process each CSV file
-    for filename in os.listdir(source_dir):
-        if filename.endswith('.csv'):
+    store = GlucoseStore(processed_dir)
+    if not store.exists() and any(filename.endswith('.json') for filename in os.listdir(processed_dir)):
+        print(f"Importing {len(store.import_json(processed_dir))} day(s) from per-day JSON files...")
+
+    manifest = IngestManifest()
+    if full or manifest.glucose_threshold != GLUCOSE_THRESHOLD or not store.exists():
+        # Periods stored in processed files depend on the threshold
+        manifest.clear()
+        manifest.glucose_threshold = GLUCOSE_THRESHOLD
+
+    csv_files = sorted(filename for filename in os.listdir(source_dir) if filename.endswith('.csv'))
+    for filename in set(manifest.files) - set(csv_files):
+        print(f"Source file {filename} was removed, forgetting it")
+        manifest.forget(filename)
+
+    changed = []
+    with metrics.stage('manifest'):
+        for filename in csv_files:
+            if manifest.is_unchanged(filename, os.path.join(source_dir, filename)):
+                print(f"Skipping {filename} (unchanged)")
+            else:
+                changed.append(filename)
+                metrics.count('csv_bytes', os.path.getsize(os.path.join(source_dir, filename)))
+    metrics.count('csv_files', len(changed))
+
+    # Changed files are parsed once: the scan spills their readings for the merge, and
+    # the days they cover decide which unchanged files take part in it. The store lock
+    # is held from the scan to the write, so live ingest cannot append readings in between
+    with store.locked(), tempfile.TemporaryDirectory(prefix='glucose-ingest-') as spill_dir:
+        spill_paths = {filename: os.path.join(spill_dir, f"{index}.pickle") for index, filename in enumerate(changed)}
+        affected_days = set()
+        scan_tasks = [(os.path.join(source_dir, filename), spill_paths[filename]) for filename in changed]
+        if workers > 1:
+            scans = metrics.timed('workers', map_in_pool(spill_csv_file, scan_tasks, workers))
+        else:
+            scans = (spill_csv_file(*task) for task in scan_tasks)
+        # Scans first, so the pool shuts down (and its workers let go of the store lock) when they run out
+        for (days, in_order), filename in zip(scans, changed):
             print(f"Processing {filename}...")
-            csv_path = os.path.join(source_dir, filename)
-            measurements = process_csv_file(csv_path)
-            save_json_files(measurements, processed_dir)
+            affected_days.update(manifest.days_for(filename))
+            affected_days.update(days)
+            manifest.record(filename, os.path.join(source_dir, filename), days, in_order)
+
+        # Oldest export first, so the newest export wins glucose value conflicts in the merge
+        sources = sorted((filename for filename in csv_files if affected_days.intersection(manifest.days_for(filename))),
+                         key=lambda filename: (export_date(os.path.join(source_dir, filename)), filename))
+        unchanged = [filename for filename in sources if filename not in spill_paths]
+        if workers > 1:
+            # Workers spill the affected days of unchanged files too; the merge streams
+            # every source from disk, so the parent never holds whole files in memory
+            for index, filename in enumerate(unchanged, len(spill_paths)):
+                spill_paths[filename] = os.path.join(spill_dir, f"{index}.pickle")
+            read_tasks = [(os.path.join(source_dir, filename), spill_paths[filename], affected_days)
+                          for filename in unchanged]
+            for _ in metrics.timed('workers', map_in_pool(spill_csv_file, read_tasks, workers)):
+                pass
+            streams = [iter_spilled_readings(spill_paths[filename]) for filename in sources]
+        else:
+            unchanged_streams = {filename: iter_file_readings(os.path.join(source_dir, filename), affected_days,
+                                                              manifest.is_in_order(filename))
+                                 for filename in unchanged}
+            streams = [unchanged_streams[filename] if filename in unchanged_streams
+                       else iter_spilled_readings(spill_paths[filename]) for filename in sources]
+
+        days = metrics.timed('merge', iter_merged_days(merge_readings(streams)))
+        # Days are analyzed in bounded batches, one vectorized call per batch
+        day_batches = iter(lambda: list(itertools.islice(days, ANALYZE_BATCH_DAYS)), [])
+        if workers > 1:
+            batches = metrics.timed('workers', map_in_pool(analyze_days, ((batch,) for batch in day_batches), workers))
+        else:
+            batches = metrics.timed('analyze', map(analyze_days, day_batches))
+        analyzed = (record for batch in batches for record in batch)
+
+        with metrics.stage('store_write'):
+            written = store.write_days(analyzed)
+    rows = sum(store.days[date]['count'] for date in written)
+    metrics.count('rows', rows)
+    metrics.count('days', len(written))
+    metrics.count('store_bytes', rows * 8)  # int32 minute + float32 value per row
+    # Derived caches only change with the store here (the server and live ingest sync
+    # them before use), so a run that wrote no days only builds the missing ones. Under
+    # the store lock, so live ingest does not write rollups at the same time
+    cache_files = ('rollups.npz', 'note_index.json', 'meal_responses.json')
+    if written or not all(os.path.exists(os.path.join(processed_dir, name)) for name in cache_files):
+        with store.locked():
+            with metrics.stage('rollups'):
+                RollupStore(processed_dir).sync(store)
+            with metrics.stage('note_index'):
+                note_index = NoteIndex(processed_dir)
+                note_index.sync(store, NotesManager())
+            with metrics.stage('meal_responses'):
+                MealResponseCache(processed_dir).sync(store, note_index)
+
+    with metrics.stage('manifest'):
+        manifest.save()
+    if changed:
+        print(f"Updated {len(written)} day(s) from {len(sources)} file(s)")
+
+    if not report:
+        return
+
+    if bundle_dir:
+        from report_bundle import generate_report_bundle
+        index_file = generate_report_bundle(processed_dir, bundle_dir, workers=workers, chunk_size=chunk_size)
+        print(f"Generated report bundle: {index_file}")
+        return
 
     # Generate HTML report
     from report_generator import generate_html_report
-    generate_html_report(processed_dir, 'glucose_report.html')
+    generate_html_report(processed_dir, 'glucose_report.html', workers=workers, chunk_size=chunk_size,
+                         fast_render=fast_render)
     print("Generated HTML report: glucose_report.html")
 
 def main():
-    process_csv_files()
+    parser = argparse.ArgumentParser(description='Process LibreLink CSV exports and generate the glucose report')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the ingest manifest and rebuild all days from every source file')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='parse, analyze and render in N worker processes (default: 1)')
+    parser.add_argument('--chunk-size', type=int, default=8, metavar='K',
+                        help='number of days sent to a worker at once when rendering the report (default: 8)')
+    parser.add_argument('--fast-render', action='store_true',
+                        help='serialize plots directly to Plotly JSON instead of building go.Figure objects')
+    parser.add_argument('--bundle', nargs='?', const='glucose_report_bundle', metavar='DIR',
+                        help='write the report as a self-contained bundle with local, precompressed assets '
+                             'to DIR (default: glucose_report_bundle) instead of glucose_report.html')
+    parser.add_argument('--export-json', metavar='DIR',
+                        help='only export processed days as per-day JSON files to DIR and exit')
+    parser.add_argument('--profile', nargs='?', const='glucose.prof', metavar='FILE',
+                        help='run under cProfile and save the stats to FILE (default: glucose.prof)')
+    args = parser.parse_args()
+    if args.export_json:
+        count = GlucoseStore('data/processed').export_json(args.export_json)
+        print(f"Exported {count} day(s) to {args.export_json}")
+        return
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    metrics.reset()
+    process_csv_files(full=args.full, workers=max(1, args.workers), chunk_size=max(1, args.chunk_size),
+                      fast_render=args.fast_render, bundle_dir=args.bundle)
+    if profiler:
+        import pstats
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Saved profile to {args.profile} (view with: python -m pstats {args.profile})")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+    print(metrics.summary())
+    metrics.save()
 
 if __name__ == "__main__":
     main()
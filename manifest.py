@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+class IngestManifest:
+    """Record of ingested source files (size, mtime, content hash) and the days each one produced"""
+
+    def __init__(self, manifest_file: str = 'data/manifest.json'):
+        self.manifest_file = manifest_file
+        self.glucose_threshold: Optional[float] = None
+        self.files: Dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        """Load manifest from disk if it exists"""
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.glucose_threshold = data.get('glucose_threshold')
+                self.files = data.get('files', {})
+            except json.JSONDecodeError:
+                print(f"Error reading {self.manifest_file}, starting with empty manifest")
+                self.clear()
+        else:
+            self.clear()
+
+    def save(self):
+        """Save manifest atomically, so an interrupted run never leaves it half-written"""
+        os.makedirs(os.path.dirname(self.manifest_file) or '.', exist_ok=True)
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'glucose_threshold': self.glucose_threshold, 'files': self.files},
+                      f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.manifest_file)
+
+    def clear(self):
+        """Forget every ingested file, forcing a complete rebuild"""
+        self.glucose_threshold = None
+        self.files = {}
+
+    def is_unchanged(self, filename: str, csv_path: str) -> bool:
+        """Check whether the file was already ingested in its current form.
+
+        Size and mtime are compared first; the content hash is only computed when
+        they differ, so a touched but otherwise identical file is not re-parsed.
+        """
+        entry = self.files.get(filename)
+        if entry is None:
+            return False
+
+        stat = os.stat(csv_path)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if entry['size'] != stat.st_size or entry['sha256'] != file_sha256(csv_path):
+            return False
+
+        # Same content with a new mtime - remember it to skip hashing next time
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def days_for(self, filename: str) -> List[str]:
+        """Return days produced by the file in its last ingested version"""
+        entry = self.files.get(filename)
+        return list(entry['days']) if entry else []
+
+    def is_in_order(self, filename: str) -> bool:
+        """Check whether the file's days were found in date order when it was ingested"""
+        entry = self.files.get(filename)
+        return bool(entry and entry.get('in_order'))
+
+    def record(self, filename: str, csv_path: str, days: List[str], in_order: bool = False):
+        """Remember the current version of the file, the days it produced and their ordering"""
+        stat = os.stat(csv_path)
+        self.files[filename] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_sha256(csv_path),
+            'days': sorted(days),
+            'in_order': in_order
+        }
+
+    def forget(self, filename: str):
+        """Drop a file that no longer exists in the source directory"""
+        self.files.pop(filename, None)
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Compute SHA-256 of the file contents without loading it whole into memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+from datetime import date as date_type, timedelta
+from typing import Dict, List, Optional, Set
+import numpy as np
+from glucose_store import GlucoseStore
+from note_index import NoteIndex, tokenize
+
+MEAL_RESPONSE_VERSION = 1
+# Window analyzed after every note, in minutes
+WINDOW_MINUTES = 180
+# The baseline is the last reading at most this many minutes before the note
+# (or, without one, the first reading at most this many minutes after it)
+BASELINE_MINUTES = 15
+# Days computed together by sync()
+SYNC_BATCH_DAYS = 64
+
+def normalize_note(note: str) -> str:
+    """Group key of a note: its words, lowercase and without diacritics ('Kolacja, RYŻ' -> 'kolacja ryz')"""
+    return ' '.join(tokenize(note))
+
+def event_responses(minutes: np.ndarray, values: np.ndarray, event_minutes: List[int]) -> List[Optional[dict]]:
+    """Glucose response after each event, from readings on one continuous time axis.
+
+    minutes (sorted, e.g. counted from a fixed midnight) and values hold valid
+    readings only, so windows may run past midnight. Returns for every event the
+    baseline, peak rise, minutes to peak and area above the baseline (mg/dL x min,
+    trapezoidal) in the WINDOW_MINUTES after it, or None without a baseline or with
+    fewer than two readings in the window. All events are handled with array
+    operations: the windows are copied one after another and reduced per segment.
+    """
+    events = np.asarray(event_minutes, dtype=np.int64)
+    results: List[Optional[dict]] = [None] * len(events)
+    before = np.searchsorted(minutes, events - BASELINE_MINUTES)
+    start = np.searchsorted(minutes, events)
+    after = np.searchsorted(minutes, events + BASELINE_MINUTES, side='right')
+    end = np.searchsorted(minutes, events + WINDOW_MINUTES, side='right')
+    has_before = start > before
+    found = np.flatnonzero((has_before | (after > start)) & (end - start >= 2))
+    if not len(found):
+        return results
+
+    starts, lengths = start[found], (end - start)[found]
+    # Last reading at most BASELINE_MINUTES before the event, else the first one after it
+    baselines = np.where(has_before[found], values[starts - 1], values[starts])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    total = int(lengths.sum())
+    event_ids = np.repeat(np.arange(len(found)), lengths)
+    positions = np.arange(total) + np.repeat(starts - offsets, lengths)
+    window_minutes, window_values = minutes[positions], values[positions]
+
+    peaks = np.maximum.reduceat(window_values, offsets)
+    first_peaks = np.minimum.reduceat(np.where(window_values == peaks[event_ids], np.arange(total), total), offsets)
+    excess = np.maximum(window_values - baselines[event_ids], 0.0)
+    same_event = event_ids[1:] == event_ids[:-1]
+    trapezoids = (excess[1:] + excess[:-1]) / 2 * np.diff(window_minutes)
+    areas = np.bincount(event_ids[1:][same_event], weights=trapezoids[same_event], minlength=len(found))
+
+    for index, baseline, peak, peak_minute, area, readings in zip(
+            found.tolist(), baselines.tolist(), peaks.tolist(), window_minutes[first_peaks].tolist(),
+            areas.tolist(), lengths.tolist()):
+        results[index] = {
+            'baseline': baseline,
+            'peak_rise': peak - baseline,
+            'time_to_peak': peak_minute - event_minutes[index],
+            'area': round(area, 1),
+            'readings': readings
+        }
+    return results
+
+class MealResponseCache:
+    """Responses to note events (meals, insulin...), cached per day of the note.
+
+    A day's events depend on its notes (with overrides) and on the readings of the
+    day before (baseline) and after (windows past midnight), so each cached day
+    remembers those three store blocks and its overrides and is recomputed only when
+    one of them changes. Kept in meal_responses.json next to the store.
+    """
+
+    def __init__(self, store_dir: str = 'data/processed'):
+        self.store_dir = store_dir
+        self.cache_file = os.path.join(store_dir, 'meal_responses.json')
+        # date -> {'signature': [...], 'events': [{'timestamp', 'note', response...}, ...]}
+        self.days: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        with self._lock:
+            self.days = {}
+            if not os.path.exists(self.cache_file):
+                return
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') == MEAL_RESPONSE_VERSION and cache.get('window') == WINDOW_MINUTES:
+                self.days = cache['days']
+
+    def save(self):
+        """Atomically replace the cache file"""
+        with self._lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'version': MEAL_RESPONSE_VERSION, 'window': WINDOW_MINUTES, 'days': self.days},
+                                   ensure_ascii=False, separators=(',', ':')))
+            os.replace(tmp_file, self.cache_file)
+
+    def _compute_days(self, store: GlucoseStore, notes_by_date: Dict[str, Dict[str, str]]) -> Dict[str, List[dict]]:
+        """Events of the given days ({date: {timestamp: note}}), from one time axis over them and their neighbours"""
+        dates = set()
+        for date in notes_by_date:
+            day = date_type.fromisoformat(date)
+            dates.update((day + timedelta(days=offset)).isoformat() for offset in range(-1, 2))
+        minutes, values = [np.zeros(0, np.int64)], [np.zeros(0)]
+        # Minutes counted from the date ordinal epoch, so windows run across midnight
+        for date in sorted(date for date in dates if date in store.days):
+            record = store.read_day(date)
+            valid = record.valid_rows()
+            minutes.append(record.minutes[valid].astype(np.int64) + date_type.fromisoformat(date).toordinal() * 1440)
+            values.append(record.glucose_values()[valid])
+
+        keys, event_minutes = [], []
+        for date, notes in sorted(notes_by_date.items()):
+            day_start = date_type.fromisoformat(date).toordinal() * 1440
+            for timestamp in sorted(notes):
+                keys.append((date, timestamp))
+                event_minutes.append(day_start + int(timestamp[11:13]) * 60 + int(timestamp[14:16]))
+        responses = event_responses(np.concatenate(minutes), np.concatenate(values), event_minutes)
+        events: Dict[str, List[dict]] = {date: [] for date in notes_by_date}
+        for (date, timestamp), response in zip(keys, responses):
+            if response is not None:
+                events[date].append(dict(timestamp=timestamp, note=notes_by_date[date][timestamp], **response))
+        return events
+
+    def sync(self, store: GlucoseStore, note_index: NoteIndex) -> int:
+        """Recompute days whose notes or surrounding readings changed; return their number.
+
+        note_index must be synced with the store and overrides first. Changed days
+        are computed together, SYNC_BATCH_DAYS at a time.
+        """
+        with self._lock:
+            updated = 0
+            for date in set(self.days) - set(note_index.days):
+                del self.days[date]
+                updated += 1
+            changed: Dict[str, list] = {}
+            for date, indexed in note_index.days.items():
+                if not indexed['notes']:
+                    if self.days.pop(date, None) is not None:
+                        updated += 1
+                    continue
+                day = date_type.fromisoformat(date)
+                signature = [store.block_id((day + timedelta(days=offset)).isoformat()) for offset in range(-1, 2)]
+                signature.append(indexed['overrides'])
+                cached = self.days.get(date)
+                if cached is None or cached['signature'] != signature:
+                    changed[date] = signature
+            dates = sorted(changed)
+            for first in range(0, len(dates), SYNC_BATCH_DAYS):
+                batch = dates[first:first + SYNC_BATCH_DAYS]
+                events = self._compute_days(store, {date: note_index.days[date]['notes'] for date in batch})
+                for date in batch:
+                    self.days[date] = {'signature': changed[date], 'events': events[date]}
+            updated += len(changed)
+            if updated:
+                self.save()
+            return updated
+
+    def events(self, start: Optional[str] = None, end: Optional[str] = None,
+               timestamps: Optional[Set[str]] = None) -> List[dict]:
+        """Return events of notes between start and end (dates, inclusive), optionally only the given timestamps"""
+        with self._lock:
+            dates = sorted(date for date in self.days
+                           if (start is None or date >= start) and (end is None or date <= end))
+            return [event for date in dates for event in self.days[date]['events']
+                    if timestamps is None or event['timestamp'] in timestamps]
+
+def aggregate_responses(events: List[dict], min_count: int = 1) -> List[dict]:
+    """Group events by normalized note text; return per group averages, most frequent first"""
+    groups: Dict[str, List[dict]] = {}
+    for event in events:
+        key = normalize_note(event['note'])
+        if key:
+            groups.setdefault(key, []).append(event)
+    result = []
+    for key, group in groups.items():
+        if len(group) < min_count:
+            continue
+        rises = np.array([event['peak_rise'] for event in group])
+        result.append({
+            'note': key,
+            'label': group[-1]['note'],
+            'count': len(group),
+            'peak_rise_mean': round(float(rises.mean()), 1),
+            'peak_rise_median': round(float(np.median(rises)), 1),
+            'time_to_peak_mean': round(float(np.mean([event['time_to_peak'] for event in group])), 1),
+            'area_mean': round(float(np.mean([event['area'] for event in group])), 1),
+            'last': group[-1]['timestamp']
+        })
+    result.sort(key=lambda item: (-item['count'], item['note']))
+    return result
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Written by main.py after every run and exposed by server.py on /metrics
+INGEST_STATS_FILE = 'data/ingest_stats.json'
+
+class Metrics:
+    """Per-stage timers and counters of a run (rows, days, bytes...).
+
+    Stages nest: time spent in an inner stage is not counted in the outer one, so
+    lazily chained generators (parse inside merge inside the store write) each get
+    their own share. Meant for the single pipeline thread of main.py; work done in
+    worker processes shows up as the time spent waiting for it.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self._stack: List[str] = []
+        self._since = 0.0
+
+    def _enter(self, name: str):
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.seconds[outer] = self.seconds.get(outer, 0.0) + now - self._since
+        self._stack.append(name)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._since = now
+
+    def _exit(self):
+        now = time.perf_counter()
+        name = self._stack.pop()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self._since
+        self._since = now
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as the given stage"""
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def timed(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from iterable, timing the work of producing each item as the given stage"""
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            yield item
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self) -> str:
+        """Return a table of stages (slowest first) and counters"""
+        total = sum(self.seconds.values())
+        lines = [f"{'stage':<14}{'seconds':>10}{'share':>8}{'calls':>10}"]
+        for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"{name:<14}{seconds:>10.3f}{share:>7.1f}%{self.calls[name]:>10}")
+        lines.extend(f"{name:<14}{value:>10}" for name, value in sorted(self.counters.items()))
+        return '\n'.join(lines)
+
+    def save(self, path: str = INGEST_STATS_FILE):
+        """Write stage times and counters of the run as JSON (atomically)"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'finished': time.time(), 'seconds': self.seconds, 'calls': self.calls,
+                       'counters': self.counters}, f, indent=2)
+        os.replace(tmp_path, path)
+
+# Metrics of the current process (main.py run)
+metrics = Metrics()
+
+# Upper bounds of request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LatencyHistogram:
+    """Thread-safe request latency histogram per (endpoint, method, status)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, str, str], seconds: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def prometheus_lines(self, metric: str) -> List[str]:
+        lines = [f"# HELP {metric} HTTP request latency in seconds",
+                 f"# TYPE {metric} histogram"]
+        with self._lock:
+            series_items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for (endpoint, method, status), series in series_items:
+            labels = f'endpoint="{_escape(endpoint)}",method="{method}",status="{status}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f'{metric}_sum{{{labels}}} {series[-2]}')
+            lines.append(f'{metric}_count{{{labels}}} {series[-1]}')
+        return lines
+
+def ingest_stats_lines(path: str = INGEST_STATS_FILE) -> List[str]:
+    """Prometheus lines for the stage times and counters of the last main.py run"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+    lines = ['# HELP glucose_ingest_last_run_timestamp_seconds When the last ingest run finished',
+             '# TYPE glucose_ingest_last_run_timestamp_seconds gauge',
+             f"glucose_ingest_last_run_timestamp_seconds {stats['finished']}",
+             '# HELP glucose_ingest_stage_seconds Time spent in each stage of the last ingest run',
+             '# TYPE glucose_ingest_stage_seconds gauge']
+    lines.extend(f'glucose_ingest_stage_seconds{{stage="{_escape(name)}"}} {seconds}'
+                 for name, seconds in sorted(stats['seconds'].items()))
+    lines.extend(['# HELP glucose_ingest_items Rows, days and bytes handled by the last ingest run',
+                  '# TYPE glucose_ingest_items gauge'])
+    lines.extend(f'glucose_ingest_items{{name="{_escape(name)}"}} {value}'
+                 for name, value in sorted(stats['counters'].items()))
+    return lines
+
+def gauge_lines(metric: str, help_text: str, value: Optional[float]) -> List[str]:
+    if value is None:
+        return []
+    return [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,172 @@
+import bisect
+import json
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+from glucose_store import GlucoseStore
+from notes_manager import NotesManager
+
+NOTE_INDEX_VERSION = 1
+# Glucose readings returned around every search hit, in minutes
+CONTEXT_BEFORE = 60
+CONTEXT_AFTER = 120
+
+@lru_cache(maxsize=4096)
+def tokenize(text: str) -> Tuple[str, ...]:
+    """Split text into lowercase words without diacritics ('Śniadanie, ŁOSOŚ' -> ('sniadanie', 'losos')).
+
+    Cached - the same few notes (meals, insulin...) come back day after day.
+    """
+    text = unicodedata.normalize('NFKD', text.lower().replace('ł', 'l'))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return tuple(re.findall(r'\w+', text))
+
+def shift_timestamp(timestamp: str, minutes: int) -> str:
+    return (datetime.fromisoformat(timestamp) + timedelta(minutes=minutes)).isoformat()
+
+class NoteIndex:
+    """Inverted index of the notes shown in the report: CSV notes with overrides applied.
+
+    Maps every word to the timestamps of notes containing it; queries match words by
+    prefix. The effective notes of each day are kept in note_index.json with the
+    store block and overrides they came from, so sync() re-reads only days that
+    were rewritten or whose notes were edited, and the word index is rebuilt from
+    the file on load.
+    """
+
+    def __init__(self, store_dir: str = 'data/processed'):
+        self.store_dir = store_dir
+        self.index_file = os.path.join(store_dir, 'note_index.json')
+        # date -> {'source': store block, 'overrides': [[minute, note], ...], 'notes': {timestamp: note}}
+        self.days: Dict[str, dict] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self._words: Optional[List[str]] = None
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        with self._lock:
+            self.days = {}
+            self.postings = {}
+            self._words = None
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') == NOTE_INDEX_VERSION:
+                    self.days = index['days']
+            for day in self.days.values():
+                self._add_postings(day['notes'])
+
+    def save(self):
+        """Atomically replace the index file"""
+        with self._lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'version': NOTE_INDEX_VERSION, 'days': self.days}, ensure_ascii=False,
+                                   separators=(',', ':')))
+            os.replace(tmp_file, self.index_file)
+
+    def _add_postings(self, notes: Dict[str, str]):
+        for timestamp, note in notes.items():
+            for word in set(tokenize(note)):
+                timestamps = self.postings.get(word)
+                if timestamps is None:
+                    timestamps = self.postings[word] = set()
+                    self._words = None
+                timestamps.add(timestamp)
+
+    def _remove_postings(self, notes: Dict[str, str]):
+        for timestamp, note in notes.items():
+            for word in set(tokenize(note)):
+                timestamps = self.postings.get(word)
+                if timestamps is not None:
+                    timestamps.discard(timestamp)
+                    if not timestamps:
+                        del self.postings[word]
+                        self._words = None
+
+    def _update_day(self, store: GlucoseStore, notes_manager: NotesManager, date: str) -> bool:
+        """Re-index one day if its store block or overrides changed; return True if it did"""
+        old = self.days.get(date)
+        if date not in store.days:
+            if old is None:
+                return False
+            self._remove_postings(old['notes'])
+            del self.days[date]
+            return True
+        source = store.block_id(date)
+        overrides = [[minute, note] for minute, note in sorted(notes_manager.notes_for_date(date).items())]
+        if old is not None and old['source'] == source and old['overrides'] == overrides:
+            return False
+
+        record = notes_manager.apply_overrides(store.read_day(date))
+        notes = {record.timestamp(row): note for row, note in sorted(record.notes.items()) if note}
+        if old is not None:
+            self._remove_postings(old['notes'])
+        self._add_postings(notes)
+        self.days[date] = {'source': source, 'overrides': overrides, 'notes': notes}
+        return True
+
+    def sync(self, store: GlucoseStore, notes_manager: NotesManager) -> int:
+        """Bring the index up to date with the store and overrides; return the number of re-indexed days"""
+        with self._lock:
+            dates = set(self.days) | set(store.days)
+            updated = sum(self._update_day(store, notes_manager, date) for date in dates)
+            if updated:
+                self.save()
+            return updated
+
+    def update_day(self, store: GlucoseStore, notes_manager: NotesManager, date: str) -> bool:
+        """Re-index one day after its note was edited"""
+        with self._lock:
+            updated = self._update_day(store, notes_manager, date)
+            if updated:
+                self.save()
+            return updated
+
+    def _matching(self, prefix: str) -> Set[str]:
+        """Timestamps of notes with a word starting with prefix"""
+        if self._words is None:
+            self._words = sorted(self.postings)
+        matches: Set[str] = set()
+        position = bisect.bisect_left(self._words, prefix)
+        while position < len(self._words) and self._words[position].startswith(prefix):
+            matches |= self.postings[self._words[position]]
+            position += 1
+        return matches
+
+    def search(self, query: str) -> List[str]:
+        """Return timestamps of notes containing all words of the query (as word prefixes), newest first"""
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not words:
+            return []
+        with self._lock:
+            matches = self._matching(words[0])
+            for word in words[1:]:
+                if not matches:
+                    break
+                matches &= self._matching(word)
+        return sorted(matches, reverse=True)
+
+    def note(self, timestamp: str) -> Optional[str]:
+        day = self.days.get(timestamp[:10])
+        return day['notes'].get(timestamp) if day else None
+
+def search_with_context(index: NoteIndex, store: GlucoseStore, query: str, limit: int = 50) -> dict:
+    """Search notes and attach the glucose readings from CONTEXT_BEFORE to CONTEXT_AFTER minutes around each hit"""
+    timestamps = index.search(query)
+    results = []
+    for timestamp in timestamps[:limit]:
+        context_timestamps, context_values = store.read_window(shift_timestamp(timestamp, -CONTEXT_BEFORE),
+                                                               shift_timestamp(timestamp, CONTEXT_AFTER))
+        results.append({
+            'timestamp': timestamp,
+            'note': index.note(timestamp),
+            'context': {'x': context_timestamps, 'y': context_values}
+        })
+    return {'query': query, 'total': len(timestamps), 'results': results}
@@ -1,32 +1,165 @@
+import atexit
 import json
 import os
+import threading
 from typing import Dict, Optional
+import numpy as np
+from day_record import DayRecord, minute_of_day
 
 class NotesManager:
-    def __init__(self, data_dir: str = 'data/user'):
+    """Note overrides keyed by timestamp.
+
+    Edits are appended to a journal (one JSON line per change) instead of rewriting
+    the whole file. The journal is fsynced in batches by a background thread every
+    fsync_interval seconds, and compacted into the notes_override.json snapshot once
+    it holds compact_after entries. Startup replays the snapshot and then the journal.
+    All methods are thread-safe.
+    """
+
+    def __init__(self, data_dir: str = 'data/user', fsync_interval: float = 1.0, compact_after: int = 1000):
         self.data_dir = data_dir
         self.notes_file = os.path.join(data_dir, 'notes_override.json')
+        self.journal_file = os.path.join(data_dir, 'notes_override.journal')
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
         self.notes: Dict[str, str] = {}
+        self._notes_by_date: Optional[Dict[str, Dict[int, str]]] = None
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_entries = 0
+        self._unsynced = False
+        self._background: Optional[threading.Thread] = None
+        self._stop = threading.Event()
         # Upewnij się, że katalog istnieje
         os.makedirs(data_dir, exist_ok=True)
         self.load_notes()
     
     def load_notes(self):
-        """Load notes from override file if it exists"""
-        if os.path.exists(self.notes_file):
-            try:
-                with open(self.notes_file, 'r', encoding='utf-8') as f:
-                    self.notes = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Error reading {self.notes_file}, starting with empty notes")
+        """Load notes from the snapshot file and replay the journal written after it"""
+        with self._lock:
+            if os.path.exists(self.notes_file):
+                try:
+                    with open(self.notes_file, 'r', encoding='utf-8') as f:
+                        self.notes = json.load(f)
+                except json.JSONDecodeError:
+                    print(f"Error reading {self.notes_file}, starting with empty notes")
+                    self.notes = {}
+            else:
                 self.notes = {}
-        else:
-            self.notes = {}
-    
+            self._journal_entries = self._replay_journal()
+            self._notes_by_date = None
+
+    def _replay_journal(self) -> int:
+        """Apply journal entries to notes; return the number of entries.
+
+        The journal is only read here, so processes that never edit notes (main.py,
+        report rendering) leave it alone. An unreadable line in the middle is skipped;
+        a last line without a newline may be torn by a crash and is ignored unless it
+        decodes. The writer repairs it before its first append (see _repair_journal).
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+        entries = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    if line.endswith(b'\n'):
+                        print(f"Skipping an unreadable entry in {self.journal_file}")
+                    continue
+                if entry['op'] == 'set':
+                    self.notes[entry['timestamp']] = entry['note']
+                else:
+                    self.notes.pop(entry['timestamp'], None)
+                entries += 1
+        return entries
+
+    def _repair_journal(self):
+        """Make the journal end with a whole line before entries are appended to it.
+
+        A torn last line is cut off, so the next entry is not appended to the fragment
+        (and lost with it on the next replay); a whole last entry whose newline was
+        not written gets it.
+        """
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb+') as f:
+            content = f.read()
+            if not content or content.endswith(b'\n'):
+                return
+            last_start = content.rfind(b'\n') + 1
+            try:
+                json.loads(content[last_start:])
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                print(f"Dropping a torn entry at the end of {self.journal_file}")
+                f.truncate(last_start)
+            else:
+                f.write(b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append(self, entry: dict):
+        """Append a change to the journal; fsync is left to the background thread"""
+        if self._journal is None:
+            self._repair_journal()
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        self._journal_entries += 1
+        self._unsynced = True
+        if self._background is None:
+            self._background = threading.Thread(target=self._run_background, name='notes-journal', daemon=True)
+            self._background.start()
+            atexit.register(self.close)
+
+    def _run_background(self):
+        while not self._stop.wait(self.fsync_interval):
+            self.flush()
+            if self._journal_entries >= self.compact_after:
+                self.compact()
+
+    def flush(self):
+        """Force journal entries written so far to disk"""
+        with self._lock:
+            if self._journal is not None and self._unsynced:
+                os.fsync(self._journal.fileno())
+                self._unsynced = False
+
+    def compact(self):
+        """Write all notes into the snapshot file and empty the journal.
+
+        The snapshot is replaced atomically before the journal is truncated; if a
+        crash happens in between, replaying the old journal over the new snapshot
+        gives the same notes.
+        """
+        with self._lock:
+            tmp_file = self.notes_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.notes, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.notes_file)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_entries = 0
+            self._unsynced = False
+
     def save_notes(self):
         """Save notes to override file"""
-        with open(self.notes_file, 'w', encoding='utf-8') as f:
-            json.dump(self.notes, f, indent=2, ensure_ascii=False)
+        self.compact()
+
+    def close(self):
+        """Stop the background thread and make pending journal entries durable"""
+        self._stop.set()
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
     
     def get_note(self, timestamp: str) -> Optional[str]:
         """Get note for timestamp, return None if not found"""
@@ -34,19 +167,38 @@ class NotesManager:
     
     def set_note(self, timestamp: str, note: str):
         """Set or update note for timestamp"""
-        self.notes[timestamp] = note
-        self.save_notes()
+        with self._lock:
+            self.notes[timestamp] = note
+            self._notes_by_date = None
+            self._append({'op': 'set', 'timestamp': timestamp, 'note': note})
     
     def delete_note(self, timestamp: str):
         """Delete note for timestamp if it exists"""
-        if timestamp in self.notes:
-            del self.notes[timestamp]
-            self.save_notes()
-
-    def apply_overrides(self, measurements: list) -> list:
-        """Apply note overrides to measurements list"""
-        for measurement in measurements:
-            override = self.get_note(measurement['timestamp'])
-            if override is not None:
-                measurement['note'] = override
-        return measurements
+        with self._lock:
+            if timestamp in self.notes:
+                del self.notes[timestamp]
+                self._notes_by_date = None
+                self._append({'op': 'delete', 'timestamp': timestamp})
+
+    def notes_for_date(self, date: str) -> Dict[int, str]:
+        """Return overrides of one day keyed by minute of the day"""
+        with self._lock:
+            if self._notes_by_date is None:
+                notes_by_date = {}
+                for timestamp, note in self.notes.items():
+                    try:
+                        minute = minute_of_day(timestamp)
+                    except ValueError:
+                        continue
+                    notes_by_date.setdefault(timestamp[:10], {})[minute] = note
+                self._notes_by_date = notes_by_date
+            return self._notes_by_date.get(date, {})
+
+    def apply_overrides(self, record: DayRecord) -> DayRecord:
+        """Apply note overrides to readings of a day record"""
+        for minute, note in self.notes_for_date(record.date).items():
+            first_row = int(np.searchsorted(record.minutes, minute, side='left'))
+            last_row = int(np.searchsorted(record.minutes, minute, side='right'))
+            for row in range(first_row, last_row):
+                record.notes[row] = note
+        return record
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from typing import Optional
+import numpy as np
+from day_record import DayRecord
+
+# Bump when the fragment markup changes, so old cached fragments are not reused
+RENDER_CACHE_VERSION = 2
+
+class FragmentCache:
+    """Size-bounded on-disk cache of rendered per-day report fragments.
+
+    Each fragment is stored in its own file named after its key. Reading a fragment
+    refreshes its mtime, and evict() removes the least recently used files above
+    max_entries.
+    """
+
+    def __init__(self, cache_dir: str = 'data/cache/fragments', max_entries: int = 2000):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.html")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached fragment or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return html
+
+    def put(self, key: str, html: str):
+        """Store fragment (written atomically, so readers never see half a file)"""
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove least recently used fragments above the size bound"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.html'):
+                path = os.path.join(self.cache_dir, filename)
+                entries.append((os.stat(path).st_mtime_ns, path))
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            os.remove(path)
+
+def day_fragment_key(record: DayRecord, *settings) -> str:
+    """Hash everything a day's fragment depends on.
+
+    Covers the readings, the notes as shown (CSV notes with overrides applied), the
+    high glucose periods and the given config settings (thresholds).
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([RENDER_CACHE_VERSION, record.date, settings,
+                              sorted(record.notes.items()),
+                              [period.to_list() for period in record.periods]],
+                             ensure_ascii=False).encode('utf-8'))
+    digest.update(np.ascontiguousarray(record.minutes, dtype=np.int32).tobytes())
+    digest.update(np.ascontiguousarray(record.values, dtype=np.float32).tobytes())
+    return digest.hexdigest()
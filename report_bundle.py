@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional
+from fast_plot import shared_layout_script
+from metrics import metrics
+from report_generator import html_document, render_report_content
+
+BUNDLE_DIR = 'glucose_report_bundle'
+# Downloaded copies of assets that no Python package ships; for an offline machine
+# put the files here by hand
+VENDOR_DIR = 'data/cache/vendor'
+VENDOR_URLS = {
+    'bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+}
+# Files that get .gz (and, with the brotli package installed, .br) variants
+COMPRESSED_EXTENSIONS = ('.html', '.js', '.css')
+
+def vendored_asset(name: str) -> bytes:
+    """Return a vendored file, downloading it into VENDOR_DIR the first time"""
+    path = os.path.join(VENDOR_DIR, name)
+    if not os.path.exists(path):
+        import requests
+        print(f"Downloading {VENDOR_URLS[name]}...")
+        try:
+            response = requests.get(VENDOR_URLS[name], timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise RuntimeError(f"Cannot download {name} ({e}); save {VENDOR_URLS[name]} as {path}") from e
+        os.makedirs(VENDOR_DIR, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(response.content)
+        os.replace(path + '.tmp', path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def plotly_js() -> bytes:
+    """Return plotly.min.js shipped with the installed plotly package"""
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs().encode('utf-8')
+
+def hashed_name(name: str, content: bytes) -> str:
+    """Insert a content hash after the first part of the name ('plotly.min.js' -> 'plotly.<hash>.min.js')"""
+    stem, _, extension = name.partition('.')
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}.{extension}"
+
+def brotli_compress(content: bytes) -> Optional[bytes]:
+    """Compress with brotli if the optional brotli package is installed"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(content, quality=11)
+
+def write_file(path: str, content: bytes):
+    """Write a file atomically, with precompressed variants for text files"""
+    variants = {path: content}
+    if path.endswith(COMPRESSED_EXTENSIONS):
+        # mtime=0 keeps the .gz file identical for identical content
+        variants[path + '.gz'] = gzip.compress(content, compresslevel=9, mtime=0)
+        compressed = brotli_compress(content)
+        if compressed is not None:
+            variants[path + '.br'] = compressed
+    for variant_path, variant in variants.items():
+        with open(variant_path + '.tmp', 'wb') as f:
+            f.write(variant)
+        os.replace(variant_path + '.tmp', variant_path)
+
+def generate_report_bundle(processed_data_dir: str, output_dir: str = BUNDLE_DIR, use_cache: bool = True,
+                           workers: int = 1, chunk_size: int = 8) -> str:
+    """Write the report as a self-contained directory: index.html and content-hashed assets.
+
+    Works without network access: Plotly and Bootstrap are vendored (jQuery is not
+    used by the report and left out) and the plot template and layout defaults are
+    defined once in assets/report.<hash>.js instead of in every day. Asset names
+    change with their content, so they can be cached forever. Returns the path of
+    index.html.
+    """
+    content = render_report_content(processed_data_dir, use_cache, workers, chunk_size,
+                                     fast_render=True, shared_layout=True)
+    with metrics.stage('bundle_write'):
+        assets: Dict[str, bytes] = {
+            'bootstrap.min.css': vendored_asset('bootstrap.min.css'),
+            'plotly.min.js': plotly_js(),
+            'report.js': shared_layout_script().encode('utf-8'),
+        }
+        names = {name: hashed_name(name, data) for name, data in assets.items()}
+        assets_dir = os.path.join(output_dir, 'assets')
+        os.makedirs(assets_dir, exist_ok=True)
+        for name, data in assets.items():
+            if not os.path.exists(os.path.join(assets_dir, names[name])):
+                write_file(os.path.join(assets_dir, names[name]), data)
+        # Drop assets of earlier bundles
+        current = set(names.values())
+        for filename in os.listdir(assets_dir):
+            base = filename[:-4] if filename.endswith('.tmp') else filename
+            if base.endswith(('.gz', '.br')):
+                base = base[:-3]
+            if base not in current:
+                os.remove(os.path.join(assets_dir, filename))
+
+        links = (f'<link href="assets/{names["bootstrap.min.css"]}" rel="stylesheet">\n'
+                 f'        <script src="assets/{names["plotly.min.js"]}"></script>\n'
+                 f'        <script src="assets/{names["report.js"]}"></script>')
+        index_file = os.path.join(output_dir, 'index.html')
+        write_file(index_file, html_document(content, assets=links).encode('utf-8'))
+    metrics.count('report_bytes', os.path.getsize(index_file))
+    return index_file
@@ -1,13 +1,20 @@
 import os
 import json
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import plotly.graph_objects as go
-from typing import List, Dict
+from typing import List, Dict, Optional
 from notes_manager import NotesManager
+from glucose_store import GlucoseStore
+from day_record import DayRecord, MINUTE_LABELS
+from render_cache import FragmentCache, day_fragment_key
+from fast_plot import PLOT_HEIGHT, plot_series, figure_html, template_script
+from metrics import metrics
 
 # Load configuration
 with open('config.json', 'r') as f:
     config = json.load(f)
+    GLUCOSE_THRESHOLD = config['glucose_threshold']
     POINTS_MEDIUM = config['points_thresholds']['medium']
     POINTS_HIGH = config['points_thresholds']['high']
 
@@ -20,74 +27,15 @@ def get_severity_class(points: float) -> str:
     else:
         return "bg-success bg-opacity-25"  # Light green
 
-def create_glucose_plot(data: dict) -> go.Figure:
+def create_glucose_plot(record: DayRecord, glucose_threshold: float = GLUCOSE_THRESHOLD) -> go.Figure:
     """Create a glucose plot for a single day"""
-    # Regular glucose measurements
-    timestamps = []
-    glucose_values = []
-    
-    # Notes data
-    note_timestamps = []
-    note_texts = []
-    
-    # Prepare annotations for peaks
-    annotations = []
-    for period in data['high_glucose_periods']:
-        # Find the highest glucose value in this period
-        period_start = datetime.strptime(period['start_time'], '%Y-%m-%dT%H:%M:00')
-        period_end = datetime.strptime(period['end_time'], '%Y-%m-%dT%H:%M:00')
-        
-        peak_value = 0
-        peak_time = None
-        
-        for measurement in data['measurements']:
-            m_time = datetime.strptime(measurement['timestamp'], '%Y-%m-%dT%H:%M:00')
-            if period_start <= m_time <= period_end and measurement['glucose_value'] is not None:
-                if measurement['glucose_value'] > peak_value:
-                    peak_value = measurement['glucose_value']
-                    peak_time = m_time
-        
-        if peak_time:
-            annotations.append(dict(
-                x=peak_time,
-                y=peak_value,
-                text=str(int(period['points'])),
-                showarrow=True,
-                arrowhead=0,
-                yshift=10,
-                font=dict(size=10, color='red'),
-                arrowcolor='red',
-                arrowsize=0.3,
-                arrowwidth=1
-            ))
-    
-    for measurement in data['measurements']:
-        timestamp = datetime.strptime(measurement['timestamp'], '%Y-%m-%dT%H:%M:00')
-        glucose = measurement['glucose_value']
-        note = measurement['note']
-        
-        # Always add glucose measurement if exists
-        if glucose is not None:
-            timestamps.append(timestamp)
-            glucose_values.append(glucose)
-        
-        # If there's a note, add to notes series
-        if note:
-            note_timestamps.append(timestamp)
-            note_texts.append(note)
-    
-    # Calculate y-axis range
-    if glucose_values:
-        y_min = min(v for v in glucose_values if v is not None)
-        y_max = max(v for v in glucose_values if v is not None)
-        
-        # Set default range [80, 180] unless data requires wider range
-        y_range = [
-            min(80, y_min) if y_min < 80 else 80,
-            max(180, y_max + 20) if y_max > 180 else 180  # Added +20 for annotations
-        ]
-    else:
-        y_range = [80, 180]  # Default range if no valid values
+    series = plot_series(record)
+    timestamps = series['timestamps']
+    glucose_values = series['glucose_values']
+    note_timestamps = series['note_timestamps']
+    note_texts = series['note_texts']
+    annotations = series['annotations']
+    y_range = series['y_range']
     
     fig = go.Figure()
     
@@ -122,16 +70,13 @@ def create_glucose_plot(data: dict) -> go.Figure:
         ))
     
     # Add threshold line
-    fig.add_hline(y=140, line_dash="dash", line_color="red")
+    fig.add_hline(y=glucose_threshold, line_dash="dash", line_color="red")
     
     # Add baseline
     fig.add_hline(y=100, line_color="black")
     
     # Highlight high glucose periods
-    for period in data['high_glucose_periods']:
-        start = datetime.strptime(period['start_time'], '%Y-%m-%dT%H:%M:00')
-        end = datetime.strptime(period['end_time'], '%Y-%m-%dT%H:%M:00')
-        
+    for start, end in series['periods']:
         fig.add_vrect(
             x0=start,
             x1=end,
@@ -165,20 +110,21 @@ def create_glucose_plot(data: dict) -> go.Figure:
     
     return fig
 
-def generate_notes_html(measurements: list) -> str:
+def generate_notes_html(record: DayRecord) -> str:
     """Generate HTML for notes list"""
     notes_html = []
-    for m in measurements:
-        if m['note']:
-            time = datetime.strptime(m['timestamp'], '%Y-%m-%dT%H:%M:00').strftime('%H:%M')
-            notes_html.append(f'''
+    for row in sorted(record.notes):
+        note = record.notes[row]
+        timestamp = record.timestamp(row)
+        time = MINUTE_LABELS[record.minutes[row]]
+        notes_html.append(f'''
                 <li>
-                    <strong>{time}</strong>: <span class="note-text" id="note-text-{m['timestamp']}" 
-                        onclick="toggleNoteEdit('{m['timestamp']}')">{m['note']}</span>
-                    <div id="note-edit-{m['timestamp']}" class="note-edit">
-                        <textarea id="note-textarea-{m['timestamp']}" class="form-control">{m['note']}</textarea>
-                        <button class="btn btn-sm btn-primary" onclick="saveNote('{m['timestamp']}')">Zapisz</button>
-                        <button class="btn btn-sm btn-secondary" onclick="toggleNoteEdit('{m['timestamp']}')">Anuluj</button>
+                    <strong>{time}</strong>: <span class="note-text" id="note-text-{timestamp}" 
+                        onclick="toggleNoteEdit('{timestamp}')">{note}</span>
+                    <div id="note-edit-{timestamp}" class="note-edit">
+                        <textarea id="note-textarea-{timestamp}" class="form-control">{note}</textarea>
+                        <button class="btn btn-sm btn-primary" onclick="saveNote('{timestamp}')">Zapisz</button>
+                        <button class="btn btn-sm btn-secondary" onclick="toggleNoteEdit('{timestamp}')">Anuluj</button>
                     </div>
                 </li>
             ''')
@@ -197,87 +143,85 @@ def generate_notes_html(measurements: list) -> str:
     </div>
     '''
 
-def generate_periods_html(periods: list) -> str:
+def generate_periods_html(record: DayRecord) -> str:
     """Generate HTML for high glucose periods details"""
-    if not periods:
+    if not record.periods:
         return "<p class='card-text'>Brak przekroczeń</p>"
     
     html = ["<ul class='list-unstyled mb-2'>"]
-    for period in periods:
-        start_time = datetime.strptime(period['start_time'], '%Y-%m-%dT%H:%M:00').strftime('%H:%M')
+    for period in record.periods:
+        start_time = MINUTE_LABELS[record.minutes[period.first_row]]
         html.append(
-            f"<li>{start_time}: <strong>{int(period['points'])}</strong></li>"
+            f"<li>{start_time}: <strong>{int(period.points)}</strong></li>"
         )
     html.append("</ul>")
     return "\n".join(html)
 
-def has_valid_measurements(data: dict) -> bool:
+def has_valid_measurements(record: DayRecord) -> bool:
     """Check if the day has any valid glucose measurements"""
-    return any(m['glucose_value'] is not None for m in data['measurements'])
+    return record.has_valid_measurements()
 
-def generate_html_report(processed_data_dir: str, output_file: str):
-    """Generate HTML report with all glucose plots"""
-    # Initialize notes manager
-    notes_manager = NotesManager()
+def generate_day_html(record: DayRecord, fast: bool = False, plot_html: Optional[str] = None,
+                      shared_layout: bool = False) -> str:
+    """Generate HTML fragment (plot, notes and statistics) for a single day.
+
+    With fast=True the plot is serialized by fast_plot instead of go.Figure, with
+    shared_layout=True also without the layout defaults (for pages that include
+    shared_layout_script()); a given plot_html (e.g. an empty placeholder filled in
+    by the browser) is used as is.
+    """
+    div_id = f'plot-{record.date}'
+    if plot_html is None:
+        with metrics.stage('figure'):
+            if fast or shared_layout:
+                plot_html = figure_html(record, div_id, GLUCOSE_THRESHOLD, shared_layout)
+            else:
+                plot_html = create_glucose_plot(record).to_html(full_html=False, include_plotlyjs=False,
+                                                                div_id=div_id)
     
-    # Read all JSON files and sort by date (newest first)
-    days_data = []
-    for filename in os.listdir(processed_data_dir):
-        if filename.endswith('.json') and filename != 'notes_override.json':
-            with open(os.path.join(processed_data_dir, filename), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Apply note overrides
-                data['measurements'] = notes_manager.apply_overrides(data['measurements'])
-                if data['measurements']:  # Include all days with measurements
-                    days_data.append(data)
+    # Calculate total points for the day
+    total_points = sum(period.points for period in record.periods)
+    num_periods = len(record.periods)
     
-    days_data.sort(key=lambda x: x['date'], reverse=True)
+    # Get severity class for card background
+    severity_class = get_severity_class(total_points)
     
-    # Generate plots and calculate statistics
-    plots_html = []
-    for data in days_data:
-        fig = create_glucose_plot(data)
-        
-        # Calculate total points for the day
-        total_points = sum(period['points'] for period in data['high_glucose_periods'])
-        num_periods = len(data['high_glucose_periods'])
-        
-        # Get severity class for card background
-        severity_class = get_severity_class(total_points)
-        
-        # Create HTML for this day's plot and stats
-        plot_html = f'''
+    # Create HTML for this day's plot and stats
+    return f'''
         <div class="row mb-5">
             <div class="col-12">
-                <h4 class="bg-light p-3 mb-4 rounded">{data['date']}</h4>
+                <h4 class="bg-light p-3 mb-4 rounded">{record.date}</h4>
             </div>
             <div class="col-md-9">
-                {fig.to_html(full_html=False, include_plotlyjs=False)}
-                {generate_notes_html(data['measurements'])}
+                {plot_html}
+                {generate_notes_html(record)}
             </div>
             <div class="col-md-3">
                 <div class="card {severity_class}">
                     <div class="card-body">
                         <h5 class="card-title">Przekroczenia glukozy: {num_periods}</h5>
-                        {generate_periods_html(data['high_glucose_periods'])}
+                        {generate_periods_html(record)}
                         <p class="card-text mt-2"><strong>Razem: {int(total_points)}</strong></p>
                     </div>
                 </div>
             </div>
         </div>
         '''
-        plots_html.append(plot_html)
-    
-    # Create full HTML document with interactive notes editing
-    html_content = f'''
+
+# Stylesheet and scripts of the report pages, loaded from CDNs
+CDN_ASSETS = '''<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
+        <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+        <script src="https://code.jquery.com/jquery-3.6.0.min.js"></script>'''
+
+def html_document(content: str, head_extra: str = '', assets: str = CDN_ASSETS) -> str:
+    """Wrap report content in the HTML document with styles and note editing scripts"""
+    return f'''
     <!DOCTYPE html>
     <html>
     <head>
         <title>Raport analizy glukozy</title>
         <meta charset="utf-8">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-        <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
-        <script src="https://code.jquery.com/jquery-3.6.0.min.js"></script>
+        {assets}{head_extra}
         <style>
             body {{ padding: 20px; }}
             .plotly-graph-div {{ width: 100% !important; }}
@@ -318,14 +262,220 @@ def generate_html_report(processed_data_dir: str, output_file: str):
     <body>
         <div class="container">
             <h1 class="mb-4">Raport analizy glukozy</h1>
-            <div class="plots-container">
-                {"".join(plots_html)}
-            </div>
+            {content}
         </div>
     </body>
     </html>
     '''
+
+def render_days(records: List[DayRecord], workers: int = 1, chunk_size: int = 8, fast: bool = False,
+                shared_layout: bool = False) -> List[str]:
+    """Render day fragments, in a process pool of the given size when workers > 1.
+
+    Days are independent and plot div ids are derived from the date, so the result
+    is identical to rendering them one by one; order follows records.
+    """
+    render = partial(generate_day_html, fast=fast, shared_layout=shared_layout)
+    if workers <= 1 or len(records) <= 1:
+        return [render(record) for record in records]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render, records, chunksize=max(1, chunk_size)))
+
+def render_report_content(processed_data_dir: str, use_cache: bool = True, workers: int = 1, chunk_size: int = 8,
+                          fast_render: bool = False, shared_layout: bool = False) -> str:
+    """Render the report body with all days, newest first (days are rendered by `workers` processes).
+
+    fast_render selects the fast_plot serializer, which skips go.Figure validation;
+    shared_layout leaves the layout defaults out of every day (see generate_day_html).
+    """
+    # Initialize notes manager
+    notes_manager = NotesManager()
+    
+    # Read all days from the store (newest first)
+    days_data = []
+    for record in metrics.timed('report_read', GlucoseStore(processed_data_dir).read_range()):
+        # Apply note overrides
+        notes_manager.apply_overrides(record)
+        if len(record):  # Include all days with measurements
+            days_data.append(record)
+    
+    days_data.reverse()
     
-    # Save HTML file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    # Generate plots and statistics, reusing fragments of days that did not change
+    cache = FragmentCache() if use_cache else None
+    with metrics.stage('cache'):
+        # The default render mode keeps its earlier key, so existing cache entries stay valid
+        render_mode = ('shared',) if shared_layout else ()
+        keys = [day_fragment_key(record, GLUCOSE_THRESHOLD, POINTS_MEDIUM, POINTS_HIGH, fast_render, *render_mode)
+                for record in days_data]
+        plots_html = [cache.get(key) if cache else None for key in keys]
+    missing = [i for i, plot_html in enumerate(plots_html) if plot_html is None]
+    
+    with metrics.stage('html'):
+        rendered = render_days([days_data[i] for i in missing], workers, chunk_size, fast_render, shared_layout)
+    metrics.count('report_days', len(missing))
+    metrics.count('cache_hits', len(days_data) - len(missing))
+    with metrics.stage('cache'):
+        for i, plot_html in zip(missing, rendered):
+            plots_html[i] = plot_html
+            if cache:
+                cache.put(keys[i], plot_html)
+        if cache:
+            cache.evict()
+    if cache:
+        print(f"Rendered {len(missing)} day(s), reused {len(days_data) - len(missing)} from cache")
+    return f'''<div class="plots-container">
+                {"".join(plots_html)}
+            </div>'''
+
+def generate_html_report(processed_data_dir: str, output_file: str, use_cache: bool = True,
+                         workers: int = 1, chunk_size: int = 8, fast_render: bool = False):
+    """Generate HTML report with all glucose plots (days are rendered by `workers` processes).
+
+    fast_render selects the fast_plot serializer, which skips go.Figure validation.
+    """
+    content = render_report_content(processed_data_dir, use_cache, workers, chunk_size, fast_render)
+    # Create full HTML document with interactive notes editing
+    with metrics.stage('report_write'):
+        html_content = html_document(content, template_script() if fast_render else "")
+        
+        # Save HTML file
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+    metrics.count('report_bytes', os.path.getsize(output_file))
+
+# Lazy report: the page only holds one slot per day and the browser fetches a day's
+# HTML and figure JSON from server.py when its slot comes near the viewport. Days far
+# away from the viewport are purged again, so memory does not grow with history.
+LAZY_REPORT_STYLE = f'''
+        <style>
+            .day-slot {{ min-height: {PLOT_HEIGHT + 150}px; }}
+        </style>'''
+
+LAZY_REPORT_CONTENT = '''<div id="days"></div>
+            <p id="days-sentinel" class="text-muted">Ładowanie...</p>
+            <script>
+                (function () {
+                    const PAGE_SIZE = 30;
+                    const container = document.getElementById('days');
+                    const sentinel = document.getElementById('days-sentinel');
+                    let nextCursor = '';
+                    let loadingPage = false;
+
+                    const slotObserver = new IntersectionObserver(entries => {
+                        entries.forEach(entry => entry.isIntersecting ? loadDay(entry.target) : unloadDay(entry.target));
+                    }, { rootMargin: '1500px 0px' });
+
+                    function loadDay(slot) {
+                        if (slot.dataset.state !== 'empty') return;
+                        slot.dataset.state = 'loading';
+                        fetch(`/api/report/day/${slot.dataset.date}`)
+                            .then(response => response.json())
+                            .then(day => {
+                                if (slot.dataset.state !== 'loading') return;  // unloaded in the meantime
+                                slot.innerHTML = day.html;
+                                Plotly.newPlot(`plot-${day.date}`, day.figure.data,
+                                    Object.assign({ template: window.GLUCOSE_PLOT_TEMPLATE }, day.figure.layout),
+                                    { responsive: true });
+                                slot.style.minHeight = '';
+                                slot.dataset.state = 'loaded';
+                            })
+                            .catch(() => { slot.dataset.state = 'empty'; });
+                    }
+
+                    function unloadDay(slot) {
+                        if (slot.dataset.state === 'loaded') {
+                            // Keep the height so the scroll position does not jump
+                            slot.style.minHeight = `${slot.offsetHeight}px`;
+                            const plot = document.getElementById(`plot-${slot.dataset.date}`);
+                            if (plot) Plotly.purge(plot);
+                            slot.innerHTML = '';
+                        }
+                        slot.dataset.state = 'empty';
+                    }
+
+                    function createSlot(date) {
+                        const slot = document.createElement('div');
+                        slot.className = 'day-slot';
+                        slot.dataset.date = date;
+                        slot.dataset.state = 'empty';
+                        slotObserver.observe(slot);
+                        return slot;
+                    }
+
+                    function reloadDay(slot) {
+                        if (slot.dataset.state === 'empty') return;
+                        unloadDay(slot);
+                        loadDay(slot);
+                    }
+
+                    function sentinelNearViewport() {
+                        return sentinel.getBoundingClientRect().top < window.innerHeight + 1000;
+                    }
+
+                    function loadPage() {
+                        if (loadingPage || nextCursor === null) return;
+                        loadingPage = true;
+                        fetch(`/api/report/dates?limit=${PAGE_SIZE}&before=${nextCursor}`)
+                            .then(response => response.json())
+                            .then(page => {
+                                page.dates.forEach(date => container.appendChild(createSlot(date)));
+                                nextCursor = page.next;
+                                loadingPage = false;
+                                if (nextCursor === null) {
+                                    sentinel.textContent = container.children.length ? '' : 'Brak danych';
+                                } else if (sentinelNearViewport()) {
+                                    loadPage();
+                                }
+                            })
+                            .catch(() => { loadingPage = false; });
+                    }
+
+                    new IntersectionObserver(entries => {
+                        if (entries[0].isIntersecting) loadPage();
+                    }, { rootMargin: '1000px 0px' }).observe(sentinel);
+
+                    // Live updates from server.py: new readings and high glucose periods of the newest day
+                    const live = new EventSource('/api/stream');
+                    const loadedPlot = date => {
+                        const slot = container.querySelector(`.day-slot[data-date="${date}"]`);
+                        return slot && slot.dataset.state === 'loaded' ? document.getElementById(`plot-${date}`) : null;
+                    };
+                    live.addEventListener('day', event => {
+                        const day = JSON.parse(event.data);
+                        const slot = container.querySelector(`.day-slot[data-date="${day.date}"]`);
+                        if (slot) {
+                            if (day.reload) reloadDay(slot);
+                        } else if (container.firstChild ? container.firstChild.dataset.date < day.date : nextCursor === null) {
+                            container.prepend(createSlot(day.date));
+                            sentinel.textContent = '';
+                        }
+                    });
+                    live.addEventListener('reading', event => {
+                        const reading = JSON.parse(event.data);
+                        const plot = loadedPlot(reading.date);
+                        if (plot && reading.glucose_value !== null) {
+                            Plotly.extendTraces(plot, { x: [[reading.timestamp]], y: [[reading.glucose_value]] }, [0]);
+                        }
+                    });
+                    live.addEventListener('period', event => {
+                        const period = JSON.parse(event.data);
+                        const plot = loadedPlot(period.date);
+                        if (!plot) return;
+                        if (period.closed) {
+                            // Refresh the period list and peak annotations of the day
+                            reloadDay(plot.closest('.day-slot'));
+                            return;
+                        }
+                        // Shapes 0 and 1 are the threshold and baseline lines
+                        Plotly.relayout(plot, { [`shapes[${2 + period.index}]`]: {
+                            type: 'rect', xref: 'x', yref: 'y domain', x0: period.start_time, x1: period.end_time,
+                            y0: 0, y1: 1, fillcolor: 'red', opacity: 0.1, layer: 'below', line: { width: 0 }
+                        } });
+                    });
+                })();
+            </script>'''
+
+def generate_lazy_report_shell() -> str:
+    """Return the report page that loads days from server.py while scrolling"""
+    return html_document(LAZY_REPORT_CONTENT, template_script() + LAZY_REPORT_STYLE)
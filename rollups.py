@@ -0,0 +1,303 @@
+import io
+import os
+import threading
+from datetime import date as date_type
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from day_record import DayRecord
+from glucose_store import GlucoseStore
+
+# Bump when the layout of rollups.npz changes; older files are recomputed
+ROLLUP_VERSION = 2
+# Hourly columns: min, mean, max, readings; daily columns add period points and count
+# and the sums needed to merge means and standard deviations of many days
+HOURLY_COLUMNS = ('min', 'mean', 'max', 'count')
+DAILY_COLUMNS = ('min', 'mean', 'max', 'count', 'points', 'periods', 'sum', 'sum_squares')
+# Glucose histograms have 1 mg/dL bins; higher values (LibreLink reports up to 500) share the last bin
+HISTOGRAM_BINS = 501
+# Longest range (in days) drawn from raw readings
+RAW_MAX_DAYS = 14
+# Days summarized together by sync()
+SYNC_BATCH_DAYS = 64
+
+class DayRollup:
+    """Summaries of one stored day and the store block they were computed from"""
+    __slots__ = ('source', 'hourly', 'daily', 'histogram_codes', 'histogram_counts')
+
+    def __init__(self, source: str, hourly: np.ndarray, daily: np.ndarray,
+                 histogram_codes: np.ndarray, histogram_counts: np.ndarray):
+        self.source = source
+        self.hourly = hourly
+        self.daily = daily
+        # Sparse hour x glucose histogram: code = hour * HISTOGRAM_BINS + bin
+        self.histogram_codes = histogram_codes
+        self.histogram_counts = histogram_counts
+
+def day_rollups(record: DayRecord, source: str = '') -> DayRollup:
+    """Summarize a day's glucose values: hourly 24x4 and daily rows (NaN where empty) and its histogram"""
+    return day_rollups_batch([record], [source])[0]
+
+def day_rollups_batch(records: List[DayRecord], sources: List[str]) -> List[DayRollup]:
+    """Summarize many days at once; gives the same rows as day_rollups for each record.
+
+    Readings of all days are concatenated and grouped by day x hour (minutes of a
+    record are sorted, so groups are contiguous), so the work is a few array
+    operations instead of a dozen per day.
+    """
+    n = len(records)
+    counts_per_day = [len(record) for record in records]
+    day_ids = np.repeat(np.arange(n), counts_per_day)
+    minutes = (np.concatenate([record.minutes for record in records]).astype(np.int64)
+               if n else np.zeros(0, np.int64))
+    values = np.concatenate([record.glucose_values() for record in records]) if n else np.zeros(0)
+    valid = ~np.isnan(values)
+    day_ids, values = day_ids[valid], values[valid]
+    keys = day_ids * 24 + minutes[valid] // 60
+
+    hourly = np.full((n * 24, 4), np.nan)
+    counts = np.bincount(keys, minlength=n * 24)
+    sums = np.bincount(keys, weights=values, minlength=n * 24)
+    has_data = counts > 0
+    if len(values):
+        group_starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        hourly[has_data, 0] = np.minimum.reduceat(values, group_starts)
+        hourly[has_data, 2] = np.maximum.reduceat(values, group_starts)
+    hourly[has_data, 1] = sums[has_data] / counts[has_data]
+    hourly[:, 3] = counts
+    hourly = hourly.reshape(n, 24, 4)
+
+    # Daily rows from per-day sums, and minimums and maximums over the hourly ones
+    day_counts = np.bincount(day_ids, minlength=n)
+    day_sums = np.bincount(day_ids, weights=values, minlength=n)
+    has_values = day_counts > 0
+    daily = np.full((n, len(DAILY_COLUMNS)), np.nan)
+    if len(values):
+        day_starts = np.flatnonzero(np.concatenate([[True], day_ids[1:] != day_ids[:-1]]))
+        daily[has_values, 0] = np.minimum.reduceat(values, day_starts)
+        daily[has_values, 2] = np.maximum.reduceat(values, day_starts)
+    daily[has_values, 1] = day_sums[has_values] / day_counts[has_values]
+    daily[:, 3] = day_counts
+    daily[:, 4] = [sum(period.points for period in record.periods) for record in records]
+    daily[:, 5] = [len(record.periods) for record in records]
+    daily[:, 6] = day_sums
+    daily[:, 7] = np.bincount(day_ids, weights=values * values, minlength=n)
+
+    bins = np.clip(values, 0, HISTOGRAM_BINS - 1).astype(np.int64)
+    codes, code_counts = np.unique(keys * HISTOGRAM_BINS + bins, return_counts=True)
+    code_bounds = np.searchsorted(codes, np.arange(n + 1) * 24 * HISTOGRAM_BINS).tolist()
+
+    rollups = []
+    for i, source in enumerate(sources):
+        histogram = slice(code_bounds[i], code_bounds[i + 1])
+        rollups.append(DayRollup(source, hourly[i], daily[i],
+                                 (codes[histogram] - i * 24 * HISTOGRAM_BINS).astype(np.uint16),
+                                 code_counts[histogram].astype(np.uint16)))
+    return rollups
+
+class RollupStore:
+    """Hourly and daily summaries of every stored day, for long-range views and statistics.
+
+    Kept next to the glucose store in rollups.npz. sync() recomputes only days whose
+    store block changed since the last sync (each row remembers the block it was
+    computed from), so it is cheap to call after every ingest. Histograms of all
+    days are kept concatenated (offsets into one array), so the histogram of a date
+    range is a single bincount over a slice.
+    """
+
+    def __init__(self, store_dir: str = 'data/processed'):
+        self.store_dir = store_dir
+        self.rollup_file = os.path.join(store_dir, 'rollups.npz')
+        self.rows: Dict[str, DayRollup] = {}
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        self.rows = {}
+        self._arrays = None
+        if not os.path.exists(self.rollup_file):
+            return
+        with np.load(self.rollup_file) as data:
+            if 'version' not in data.files or int(data['version']) != ROLLUP_VERSION:
+                return
+            # Every data[key] access reads the array from the file again
+            arrays = {key: data[key] for key in data.files}
+        offsets = arrays['histogram_offsets']
+        for i, (date, source) in enumerate(zip(arrays['dates'].tolist(), arrays['sources'].tolist())):
+            histogram = slice(offsets[i], offsets[i + 1])
+            self.rows[date] = DayRollup(source, arrays['hourly'][i], arrays['daily'][i],
+                                        arrays['histogram_codes'][histogram], arrays['histogram_counts'][histogram])
+
+    def save(self):
+        """Write all rows (atomically)"""
+        arrays = self.arrays()
+        os.makedirs(self.store_dir, exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, version=np.array(ROLLUP_VERSION), **arrays)
+        tmp_file = self.rollup_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_file, self.rollup_file)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Return all rows as arrays sorted by date.
+
+        dates, sources, hourly (n x 24 x 4), daily (n x len(DAILY_COLUMNS)) and the
+        histograms: day i owns histogram_codes/counts[histogram_offsets[i]:histogram_offsets[i + 1]].
+        """
+        with self._lock:
+            if self._arrays is None:
+                rows = [self.rows[date] for date in sorted(self.rows)]
+                lengths = [len(row.histogram_codes) for row in rows]
+                self._arrays = {
+                    'dates': np.array(sorted(self.rows), dtype='U10'),
+                    'sources': np.array([row.source for row in rows], dtype=str),
+                    'hourly': np.array([row.hourly for row in rows]).reshape(len(rows), 24, 4),
+                    'daily': np.array([row.daily for row in rows]).reshape(len(rows), len(DAILY_COLUMNS)),
+                    'histogram_offsets': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+                    'histogram_codes': np.concatenate([row.histogram_codes for row in rows] + [np.zeros(0, np.uint16)]),
+                    'histogram_counts': np.concatenate([row.histogram_counts for row in rows] + [np.zeros(0, np.uint16)])
+                }
+            return self._arrays
+
+    def sync(self, store: GlucoseStore) -> int:
+        """Bring rollups up to date with the store; return the number of recomputed days.
+
+        Rows are keyed by the store's block ids, so compaction does not invalidate them.
+        """
+        with self._lock:
+            updated = 0
+            for date in set(self.rows) - set(store.days):
+                del self.rows[date]
+                updated += 1
+            changed = []
+            for date in store.days:
+                source = store.block_id(date)
+                row = self.rows.get(date)
+                if row is None or row.source != source:
+                    changed.append((date, source))
+            # Batches bound the memory of a full rebuild
+            for first in range(0, len(changed), SYNC_BATCH_DAYS):
+                batch = changed[first:first + SYNC_BATCH_DAYS]
+                records = [store.read_day(date) for date, _ in batch]
+                for (date, _), row in zip(batch, day_rollups_batch(records, [source for _, source in batch])):
+                    self.rows[date] = row
+            updated += len(changed)
+            if updated:
+                self._arrays = None
+                self.save()
+            return updated
+
+    def _bounds(self, start: Optional[str], end: Optional[str]) -> Tuple[Dict[str, np.ndarray], int, int]:
+        arrays = self.arrays()
+        first = 0 if start is None else int(np.searchsorted(arrays['dates'], start, side='left'))
+        last = len(arrays['dates']) if end is None else int(np.searchsorted(arrays['dates'], end, side='right'))
+        return arrays, first, last
+
+    def daily(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[str], np.ndarray]:
+        """Return (dates, daily rows) of days between start and end (inclusive)"""
+        arrays, first, last = self._bounds(start, end)
+        return arrays['dates'][first:last].tolist(), arrays['daily'][first:last]
+
+    def hourly(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[str], np.ndarray]:
+        """Return ('YYYY-MM-DDTHH:00:00' for every hour with readings, their hourly rows)"""
+        arrays, first, last = self._bounds(start, end)
+        dates = arrays['dates'][first:last]
+        rows = arrays['hourly'][first:last].reshape(-1, 4)
+        keep = np.flatnonzero(rows[:, 3] > 0)
+        timestamps = [f"{dates[i // 24]}T{i % 24:02d}:00:00" for i in keep.tolist()]
+        return timestamps, rows[keep]
+
+    def histogram(self, start: Optional[str] = None, end: Optional[str] = None) -> np.ndarray:
+        """Return the merged 24 x HISTOGRAM_BINS (hour of day x mg/dL) reading counts of a date range"""
+        arrays, first, last = self._bounds(start, end)
+        offsets = arrays['histogram_offsets']
+        selected = slice(offsets[first], offsets[last])
+        counts = np.bincount(arrays['histogram_codes'][selected], weights=arrays['histogram_counts'][selected],
+                             minlength=24 * HISTOGRAM_BINS)
+        return counts.astype(np.int64).reshape(24, HISTOGRAM_BINS)
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indexes of at most threshold points that keep the line's shape.
+
+    x must be increasing (e.g. minutes since the range start). The first and last
+    points are always kept; from every bucket in between the point forming the
+    largest triangle with the previous pick and the next bucket's average is taken.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_start = stop
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x[next_start:next_stop].mean()
+        average_y = y[next_start:next_stop].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        picked[bucket + 1] = previous
+    return picked
+
+def _minutes_since(timestamps: List[str], origin: str) -> np.ndarray:
+    """Minutes from origin (YYYY-MM-DD) for 'YYYY-MM-DDTHH:MM:00' timestamps"""
+    origin_day = date_type.fromisoformat(origin)
+    day_offsets: Dict[str, int] = {}
+    result = np.empty(len(timestamps), dtype=np.float64)
+    for i, timestamp in enumerate(timestamps):
+        day = timestamp[:10]
+        offset = day_offsets.get(day)
+        if offset is None:
+            offset = day_offsets[day] = (date_type.fromisoformat(day) - origin_day).days * 1440
+        result[i] = offset + int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+    return result
+
+def range_series(store: GlucoseStore, rollups: RollupStore, start: str, end: str,
+                 max_points: int = 1000) -> dict:
+    """Line data for a date range with at most max_points points.
+
+    Ranges of up to two weeks use raw readings, hourly rollups are used while the
+    hours fit and daily rollups beyond that; LTTB thins whatever is still too long.
+    Rollup resolutions also carry min/max bands.
+    """
+    days = (date_type.fromisoformat(end) - date_type.fromisoformat(start)).days + 1
+    if days <= RAW_MAX_DAYS:
+        timestamps, values = [], []
+        for record in store.read_range(start, end):
+            valid_rows = record.valid_rows().tolist()
+            all_timestamps = record.timestamps()
+            timestamps.extend(all_timestamps[row] for row in valid_rows)
+            values.extend(record.glucose_values()[valid_rows].tolist())
+        keep = lttb(_minutes_since(timestamps, start), np.array(values), max_points).tolist()
+        return {'resolution': 'raw', 'x': [timestamps[i] for i in keep], 'y': [values[i] for i in keep]}
+
+    if days * 24 <= max_points:
+        timestamps, rows = rollups.hourly(start, end)
+        resolution = 'hourly'
+    else:
+        timestamps, rows = rollups.daily(start, end)
+        keep_days = np.flatnonzero(rows[:, 3] > 0)
+        timestamps = [timestamps[i] for i in keep_days.tolist()]
+        rows = rows[keep_days]
+        resolution = 'daily'
+    if len(timestamps) > max_points:
+        x = _minutes_since([t if 'T' in t else f"{t}T12:00:00" for t in timestamps], start)
+        keep = lttb(x, rows[:, 1], max_points)
+        timestamps = [timestamps[i] for i in keep.tolist()]
+        rows = rows[keep]
+    return {
+        'resolution': resolution,
+        'x': timestamps,
+        'y': np.round(rows[:, 1], 1).tolist(),
+        'y_min': rows[:, 0].tolist(),
+        'y_max': rows[:, 2].tolist()
+    }
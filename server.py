@@ -1,14 +1,266 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, abort, g
+from werkzeug.security import safe_join
 from notes_manager import NotesManager
+from glucose_store import GlucoseStore
+from data_service import GZIP_MIN_SIZE, DayDataService, LiveFeed
+from fast_plot import PLOT_HEIGHT, figure_json
+from metrics import LatencyHistogram, gauge_lines, ingest_stats_lines
+from rollups import RollupStore, range_series
+from glucose_analyzer import analyze_thresholds
+from note_index import NoteIndex, search_with_context
+from meal_response import MealResponseCache, aggregate_responses
+from glycemic_stats import last_days_range, range_statistics
+from report_generator import GLUCOSE_THRESHOLD, generate_day_html, generate_lazy_report_shell
+from report_bundle import BUNDLE_DIR
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import time
 
 app = Flask(__name__)
 notes_manager = NotesManager()
+store = GlucoseStore()
+data_service = DayDataService(store, notes_manager)
+live_feed = LiveFeed(store, GLUCOSE_THRESHOLD)
+rollups = RollupStore()
+note_index = NoteIndex()
+meal_responses = MealResponseCache()
+request_latency = LatencyHistogram()
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    request_latency.observe((endpoint, request.method, str(response.status_code)),
+                            time.perf_counter() - g.request_started)
+    return response
+
+def json_bytes_response(body: bytes, etag: str, gzipped=None) -> Response:
+    """JSON response with an ETag (304 on If-None-Match) and gzip when the client accepts it"""
+    response = Response(status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+        response.set_data(gzipped() if gzipped else gzip.compress(body, compresslevel=6))
+        response.content_encoding = 'gzip'
+    else:
+        response.set_data(body)
+    return response
 
 @app.route('/')
 def home():
+    # Lightweight shell - days are fetched from /api/report/* while scrolling
+    return generate_lazy_report_shell()
+
+@app.route('/report')
+def static_report():
+    # Complete report generated by main.py
     return send_file('glucose_report.html')
 
+def send_precompressed(directory: str, filename: str, immutable: bool) -> Response:
+    """Send a file, or its .br/.gz variant when the client accepts that encoding"""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in request.accept_encodings and os.path.isfile(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype, conditional=True)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True)
+    response.vary.add('Accept-Encoding')
+    # Bundle assets have content hashes in their names, so a name never gets new content
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+    return response
+
+@app.route('/bundle/')
+@app.route('/bundle/<path:filename>')
+def report_bundle(filename='index.html'):
+    # Self-contained report written by main.py --bundle
+    return send_precompressed(BUNDLE_DIR, filename, immutable=filename.startswith('assets/'))
+
+@app.route('/api/report/dates')
+def report_dates():
+    """Page of dates with data, newest first; pass `next` as `before` to get the next page"""
+    data_service.refresh()
+    before = request.args.get('before') or None
+    limit = min(max(request.args.get('limit', 30, type=int), 1), 365)
+
+    dates = store.dates()
+    if before:
+        dates = store.dates_in_range(end=before)
+        if dates and dates[-1] == before:
+            dates = dates[:-1]
+    page = dates[-limit:][::-1]
+    has_more = len(dates) > limit
+    return jsonify({'dates': page, 'next': page[-1] if has_more else None})
+
+@app.route('/api/report/day/<date>')
+def report_day(date):
+    """Day fragment HTML with an empty plot placeholder and the figure JSON to draw in it"""
+    data_service.refresh()
+    if date not in store.days:
+        abort(404)
+    record = notes_manager.apply_overrides(store.read_day(date))
+    placeholder = (f'<div id="plot-{date}" class="plotly-graph-div" '
+                   f'style="height:{PLOT_HEIGHT}px; width:100%;"></div>')
+    return jsonify({
+        'date': date,
+        'html': generate_day_html(record, plot_html=placeholder),
+        'figure': figure_json(record, GLUCOSE_THRESHOLD)
+    })
+
+@app.route('/api/days')
+def api_days():
+    """Processed days in the inclusive range ?from=YYYY-MM-DD&to=YYYY-MM-DD (both optional)"""
+    data_service.refresh()
+    body, etag = data_service.day_range(request.args.get('from') or None, request.args.get('to') or None)
+    return json_bytes_response(body, etag)
+
+@app.route('/api/day/<date>')
+def api_day(date):
+    """One processed day in the same form as the legacy data/processed/<date>.json"""
+    data_service.refresh()
+    payload = data_service.day(date)
+    if payload is None:
+        abort(404)
+    return json_bytes_response(payload.body, payload.etag, payload.gzipped)
+
+@app.route('/api/range')
+def api_range():
+    """Glucose line for ?from=&to= (default: all days) with at most ?points= points (default 1000).
+
+    Short ranges come from raw readings, longer ones from hourly or daily rollups
+    (mean line with min/max band), thinned with LTTB.
+    """
+    data_service.refresh()
+    rollups.sync(store)
+    dates = store.dates()
+    if not dates:
+        abort(404)
+    start = request.args.get('from') or dates[0]
+    end = request.args.get('to') or dates[-1]
+    points = min(max(request.args.get('points', 1000, type=int), 10), 10000)
+    try:
+        series = range_series(store, rollups, start, end, points)
+    except ValueError:
+        abort(400)
+    series.update({'from': start, 'to': end, 'glucose_threshold': GLUCOSE_THRESHOLD})
+    body = json.dumps(series, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json_bytes_response(body, hashlib.sha1(body).hexdigest())
+
+@app.route('/api/stats')
+def api_stats():
+    """Time in ranges, mean, SD, CV, GMI and AGP percentiles for ?from=&to= or the last ?days= (default 14)"""
+    data_service.refresh()
+    rollups.sync(store)
+    start, end = request.args.get('from') or None, request.args.get('to') or None
+    if start is None and end is None:
+        start, end = last_days_range(store, min(max(request.args.get('days', 14, type=int), 1), 3650))
+    body = json.dumps(range_statistics(rollups, start, end), separators=(',', ':')).encode('utf-8')
+    return json_bytes_response(body, hashlib.sha1(body).hexdigest())
+
+@app.route('/api/thresholds')
+def api_thresholds():
+    """What-if: periods, points and time above each of ?values=120,140,180 for ?from=&to= (default: all days)"""
+    data_service.refresh()
+    try:
+        thresholds = [float(value) for value in request.args.get('values', str(GLUCOSE_THRESHOLD)).split(',')]
+    except ValueError:
+        abort(400)
+    if not 1 <= len(thresholds) <= 100:
+        abort(400)
+    records = list(store.read_range(request.args.get('from') or None, request.args.get('to') or None))
+    body = json.dumps({
+        'from': records[0].date if records else None,
+        'to': records[-1].date if records else None,
+        'days': len(records),
+        'thresholds': analyze_thresholds(records, thresholds)
+    }, separators=(',', ':')).encode('utf-8')
+    return json_bytes_response(body, hashlib.sha1(body).hexdigest())
+
+@app.route('/api/search')
+def api_search():
+    """Notes containing all words of ?q= (word prefixes, case and diacritics ignored), newest first,
+    with glucose readings around each; at most ?limit= results (default 50)"""
+    data_service.refresh()
+    note_index.sync(store, notes_manager)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    result = search_with_context(note_index, store, request.args.get('q', ''), limit)
+    body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json_bytes_response(body, hashlib.sha1(body).hexdigest())
+
+@app.route('/api/meals')
+def api_meals():
+    """Glucose response in the 3 hours after notes, grouped by note text (most frequent first).
+
+    ?q= limits to notes matching the search words, ?from=&to= to a date range and
+    ?min_count= to groups with that many events; ?events=1 adds the single events.
+    """
+    data_service.refresh()
+    note_index.sync(store, notes_manager)
+    meal_responses.sync(store, note_index)
+    query = request.args.get('q', '')
+    timestamps = set(note_index.search(query)) if query else None
+    events = meal_responses.events(request.args.get('from') or None, request.args.get('to') or None, timestamps)
+    result = {'groups': aggregate_responses(events, max(request.args.get('min_count', 1, type=int), 1))}
+    if request.args.get('events') == '1':
+        result['events'] = events
+    body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json_bytes_response(body, hashlib.sha1(body).hexdigest())
+
+@app.route('/api/stream')
+def stream():
+    """Server-sent events with readings and period updates appended to the newest day"""
+    data_service.refresh()
+    live_feed.poll()
+    last_seq = request.headers.get('Last-Event-ID', live_feed.last_seq, type=int)
+
+    def events():
+        nonlocal last_seq
+        # Send the headers right away and let the browser reconnect after 3 seconds
+        yield 'retry: 3000\n\n'
+        idle = 0
+        while True:
+            data_service.refresh()
+            live_feed.poll()
+            new_events = live_feed.events_since(last_seq)
+            for last_seq, name, data in new_events:
+                yield f"id: {last_seq}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            idle = 0 if new_events else idle + 1
+            if idle >= 15:
+                # Keep proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                idle = 0
+            time.sleep(1)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request latencies, store size and statistics of the last main.py run in Prometheus text format"""
+    data_service.refresh()
+    lines = request_latency.prometheus_lines('glucose_http_request_duration_seconds')
+    lines += gauge_lines('glucose_store_days', 'Days in the processed store', len(store.days))
+    if store.exists():
+        lines += gauge_lines('glucose_store_live_bytes', 'Bytes of current day blocks in the store', store.live_bytes())
+        lines += gauge_lines('glucose_store_garbage_bytes', 'Bytes of overwritten day blocks awaiting compaction',
+                             store.garbage_bytes())
+    lines += ingest_stats_lines()
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/save_note', methods=['POST'])
 def save_note():
     data = request.json
@@ -17,10 +269,13 @@ def save_note():
     
     if timestamp and note:
         notes_manager.set_note(timestamp, note)
+        data_service.invalidate(timestamp[:10])
+        note_index.update_day(store, notes_manager, timestamp[:10])
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': 'Missing data'})
 
 if __name__ == '__main__':
+    print(f"Wczytano do pamięci {data_service.warm()} dni")
     print("Uruchamiam serwer na http://localhost:5000")
     print("Naciśnij Ctrl+C aby zatrzymać")
     app.run(debug=True)
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import math
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from librelink_csv import LIBRELINK_COLUMNS
+
+MEAL_NOTES = {
+    7: ['śniadanie', 'owsianka', 'kanapki z serem', 'jajecznica'],
+    13: ['obiad', 'obiad - makaron', 'zupa pomidorowa', 'pierogi', 'kotlet z ziemniakami'],
+    19: ['kolacja', 'kolacja, ryż', 'pizza', 'sałatka'],
+}
+OTHER_NOTES = ['spacer', 'rower 30 min', 'stres w pracy', 'insulina 4j', 'kawa', 'ciastko']
+
+def generate_rows(start: datetime, days: int, seed: int = 0) -> List[Tuple[datetime, list]]:
+    """Generate the device history of one patient as (time, LibreLink CSV row) pairs, in time order.
+
+    Historic readings every 15 minutes follow a daily rhythm with meal spikes and
+    noise. Meals and activities add note rows, scans add rows without a historic
+    value, and sensor changes and signal losses leave gaps.
+    """
+    rng = random.Random(seed)
+    serial = f"{rng.randrange(16 ** 8):08X}-{rng.randrange(16 ** 4):04X}"
+    base = rng.uniform(95, 125)
+    rows = []
+    glucose = base
+    meal_effects = []  # [minutes since meal, peak rise]
+    gap_until = start
+    next_sensor_change = start + timedelta(days=rng.uniform(1, 14))
+
+    def row(timestamp: datetime, record_type: int, historic: str = '', scan: str = '',
+            note: str = '') -> Tuple[datetime, list]:
+        values = ['FreeStyle LibreLink', serial, timestamp.strftime('%d-%m-%Y %H:%M'), str(record_type),
+                  historic, scan] + [''] * 13
+        values[13] = note
+        return timestamp, values
+
+    t = start
+    end = start + timedelta(days=days)
+    while t < end:
+        # Meals around 7:00, 13:00 and 19:00
+        if t.minute == 0 and t.hour in MEAL_NOTES and rng.random() < 0.9:
+            meal_time = t + timedelta(minutes=rng.randint(-40, 40))
+            meal_effects.append([0, rng.uniform(30, 120)])
+            if rng.random() < 0.6:
+                rows.append(row(meal_time, 6, note=rng.choice(MEAL_NOTES[t.hour])))
+        if rng.random() < 0.01:
+            rows.append(row(t + timedelta(minutes=rng.randint(1, 14)), 6, note=rng.choice(OTHER_NOTES)))
+
+        # Daily rhythm (dawn phenomenon), meal curves and a slowly wandering level
+        minute_of_day = t.hour * 60 + t.minute
+        rhythm = 12 * math.sin((minute_of_day - 240) / 1440 * 2 * math.pi)
+        meals = 0.0
+        for effect in meal_effects:
+            elapsed = effect[0]
+            meals += effect[1] * (elapsed / 45) * math.exp(1 - elapsed / 45)
+            effect[0] += 15
+        meal_effects = [effect for effect in meal_effects if effect[0] < 300]
+        glucose += (base + rhythm + meals - glucose) * 0.3 + rng.gauss(0, 6)
+        glucose = min(max(glucose, 40.0), 400.0)
+
+        if t >= next_sensor_change:
+            # New sensor: one hour warm-up without readings
+            gap_until = t + timedelta(minutes=60)
+            next_sensor_change = t + timedelta(days=14)
+            rows.append(row(t, 6, note='nowy sensor'))
+        elif rng.random() < 0.004:
+            # Phone out of range for a while
+            gap_until = t + timedelta(minutes=15 * rng.randint(2, 16))
+
+        if t >= gap_until:
+            rows.append(row(t, 0, historic=str(int(round(glucose)))))
+            if rng.random() < 0.05:
+                scan_time = t + timedelta(minutes=rng.randint(1, 14))
+                rows.append(row(scan_time, 1, scan=str(int(round(glucose + rng.gauss(0, 4))))))
+        t += timedelta(minutes=15)
+
+    rows.sort(key=lambda timed_row: timed_row[0])
+    return rows
+
+def write_export(path: str, rows: List[list], generated: datetime, patient: str):
+    """Write rows as a LibreLink export file (UTF-8 with BOM, two header lines)"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Dane glukozy', 'Wygenerowano dnia', generated.strftime('%d-%m-%Y %H:%M UTC'),
+                         'Wygenerował', patient])
+        writer.writerow(LIBRELINK_COLUMNS)
+        writer.writerows(rows)
+
+def generate_patient(output_dir: str, start: datetime, days: int, seed: int = 0,
+                     export_days: int = 90, overlap_days: int = 14, patient: str = 'Pacjent') -> List[str]:
+    """Generate a patient's history split into overlapping exports; return the written files.
+
+    Each export covers export_days and starts overlap_days before the previous one
+    ended, like exports downloaded every few months.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows = generate_rows(start, days, seed)
+    end = start + timedelta(days=days)
+    step = max(1, export_days - overlap_days)
+    files = []
+    export_start = start
+    while True:
+        export_end = min(export_start + timedelta(days=export_days), end)
+        export_rows = [values for t, values in rows if export_start <= t < export_end]
+        path = os.path.join(output_dir, f"{patient.replace(' ', '_')}_glucose_{export_end:%d-%m-%Y}.csv")
+        write_export(path, export_rows, export_end, patient)
+        files.append(path)
+        if export_end >= end:
+            return files
+        export_start += timedelta(days=step)
+
+def generate_patients(output_dir: str, patients: int, start: datetime, days: int, seed: int = 0,
+                      export_days: int = 90, overlap_days: int = 14) -> List[str]:
+    """Generate exports for many patients, one subdirectory each; return the subdirectories"""
+    directories = []
+    for number in range(1, patients + 1):
+        directory = os.path.join(output_dir, f"patient_{number:03d}")
+        generate_patient(directory, start, days, seed * 1000 + number, export_days, overlap_days,
+                         patient=f"Pacjent {number}")
+        directories.append(directory)
+    return directories
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic LibreLink CSV exports')
+    parser.add_argument('output_dir', help='directory for the CSV files (one subdirectory per patient with --patients)')
+    parser.add_argument('--days', type=int, default=30, help='days of data per patient (default: 30)')
+    parser.add_argument('--start', default='2024-01-01', help='first day, YYYY-MM-DD (default: 2024-01-01)')
+    parser.add_argument('--patients', type=int, default=0,
+                        help='generate N patients in subdirectories instead of one patient')
+    parser.add_argument('--export-days', type=int, default=90, help='days covered by one export file (default: 90)')
+    parser.add_argument('--overlap-days', type=int, default=14,
+                        help='days shared by consecutive export files (default: 14)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, '%Y-%m-%d')
+    if args.patients:
+        directories = generate_patients(args.output_dir, args.patients, start, args.days, args.seed,
+                                        args.export_days, args.overlap_days)
+        print(f"Generated {len(directories)} patient(s) in {args.output_dir}")
+    else:
+        files = generate_patient(args.output_dir, start, args.days, args.seed, args.export_days, args.overlap_days)
+        print(f"Generated {len(files)} file(s) in {args.output_dir}")
+
+if __name__ == "__main__":
+    main()